@@ -0,0 +1,180 @@
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+from vm import Program, VMException
+from tpcc_types.parser import VariableDeclarationNode
+from tpcc_types.quaternion import *
+
+
+def load_numpy():
+    # numpy is only needed for batch execution, so it is not a requirement of the compiler
+    try:
+        import numpy
+    except ImportError:
+        raise VMException('Batch execution needs numpy, install it with: pip install numpy') from None
+    return numpy
+
+
+def declared_names(declarations: Iterable[VariableDeclarationNode]) -> List[str]:
+    return [name.value for declaration in declarations for name in declaration.names]
+
+
+class BatchMachine:
+    """
+    Runs a Program over many lanes of initial variables at once: every register holds a numpy int32
+    array with one element per lane, so arithmetic wraps around on 32 bits like in the VirtualMachine.
+    Lanes diverging on a conditional jump wait at their own instruction, and the lanes at the lowest
+    one run together under a mask, which joins them again after branches and loops.
+    Lanes dividing by zero stop there, and are flagged in failed. Issues at most limit instructions if given.
+    """
+    program: Program
+    columns: List[str]
+    steps: int
+    lanes: int
+    seconds: float
+
+    def __init__(self, program: Program, columns: Optional[Sequence[str]] = None, limit: Optional[int] = None):
+        self.numpy = load_numpy()
+        self.program = program
+        # the declared variables first, then the ones only the program knows about
+        self.columns = list(columns) if columns is not None else list()
+        self.columns += [name for name in program.variable_slots if name not in self.columns]
+        self.limit = limit
+        self.failed = None
+        self.steps = 0
+        self.lanes = 0
+        self.seconds = 0.0
+        np = self.numpy
+        # numpy operations of the opcodes, as plain ints
+        self.operations = {int(opcode): operation for opcode, operation in {
+            Opcode.ADD: np.add, Opcode.SUB: np.subtract, Opcode.MUL: np.multiply,
+            Opcode.JEQ: np.equal, Opcode.JNE: np.not_equal, Opcode.JGT: np.greater,
+            Opcode.JLT: np.less, Opcode.JGE: np.greater_equal, Opcode.JLE: np.less_equal,
+        }.items()}
+
+    def run(self, table: Dict[str, Sequence[int]], lanes: Optional[int] = None) -> Dict[str, 'numpy.ndarray']:
+        """
+        Runs the program once per row of table, a column of initial values by variable name, and returns
+        the final values of the variables as a table of the same shape. Missing columns start at zero.
+        """
+        np = self.numpy
+        program = self.program
+        unknown = [name for name in table if name not in self.columns]
+        if unknown:
+            raise VMException(f'Unknown variables: {", ".join(unknown)}')
+        columns = {name: np.asarray(values, dtype=np.int64).astype(np.int32) for name, values in table.items()}
+        sizes = {len(column) for column in columns.values()}
+        if lanes is not None:
+            sizes.add(lanes)
+        if len(sizes) > 1:
+            raise VMException(f'Columns of different lengths: {", ".join(map(str, sorted(sizes)))}')
+        lanes = self.lanes = sizes.pop() if sizes else 1
+
+        # constants and untouched variables share one read-only element across the lanes
+        registers = [np.broadcast_to(np.int32(value), (lanes,)) for value in program.registers]
+        for name, column in columns.items():
+            if name in program.variable_slots:
+                registers[program.variable_slots[name]] = column
+        self.failed = np.zeros(lanes, dtype=bool)
+
+        start = time.perf_counter()
+        try:
+            self.steps = self.dispatch(registers, lanes)
+        finally:
+            self.seconds = time.perf_counter() - start
+        results = dict()
+        for name in self.columns:
+            slot = program.variable_slots.get(name)
+            if slot is not None:
+                results[name] = np.array(registers[slot])
+            else:
+                results[name] = np.array(columns.get(name, np.zeros(lanes, dtype=np.int32)))
+        return results
+
+    def select(self, pcs) -> tuple:
+        """
+        The lowest instruction lanes wait at, the mask of those lanes or None for all of them,
+        and the instruction the other lanes wait at.
+        """
+        end = len(self.program.code)
+        pc = int(pcs.min())
+        mask = pcs == pc
+        waiting = pcs[~mask]
+        if not waiting.size:
+            return pc, None, end
+        return pc, mask, int(waiting.min())
+
+    def dispatch(self, registers: list, lanes: int) -> int:
+        np = self.numpy
+        code = self.program.code
+        operations = self.operations
+        end = len(code)
+        limit = self.limit if self.limit is not None else -1
+        ASSIGN, DIV, SHL, JUMP = (int(opcode) for opcode in (Opcode.ASSIGN, Opcode.DIV, Opcode.SHL, Opcode.JUMP))
+        pcs = np.zeros(lanes, dtype=np.int64)  # where the lanes not running wait, stale while all lanes run
+        pc = 0
+        mask = None  # the running lanes, None for all of them
+        resume = end  # the lowest instruction other lanes wait at
+        steps = 0
+        stopped = False  # whether lanes just divided by zero
+        while True:
+            if pc >= resume:
+                if mask is None:
+                    break
+                # the running lanes caught up with waiting ones, or finished
+                pcs = np.where(mask, pc, pcs)
+                pc, mask, resume = self.select(pcs)
+                continue
+            if steps == limit:
+                raise VMException(f'Stopped after {steps} instructions')
+            steps += 1
+            opcode, a, b, c = code[pc]
+            pc += 1
+            if opcode == ASSIGN:
+                value = registers[a]
+            elif opcode == JUMP:
+                pc = c
+                continue
+            elif opcode == DIV:
+                lhs, rhs = registers[a], registers[b]
+                zero = rhs == 0
+                if zero.any():
+                    # lanes not running may hold zero too
+                    rhs = np.where(zero, 1, rhs)
+                    if mask is not None:
+                        zero &= mask
+                    if zero.any():
+                        stopped = True
+                        self.failed |= zero
+                        pcs = np.where(zero, end, pcs if mask is not None else pc)
+                        mask = ~zero if mask is None else mask & ~zero
+                # truncated toward zero, on 64 bits for INT_MIN / -1 to wrap around
+                quotient = np.abs(lhs.astype(np.int64)) // np.abs(rhs.astype(np.int64))
+                value = np.where((lhs < 0) != (rhs < 0), -quotient, quotient).astype(np.int32)
+            elif opcode == SHL:
+                value = (registers[a].astype(np.int64) << registers[b]).astype(np.int32)
+            elif opcode in JUMP_OPCODES:
+                condition = operations[opcode](registers[a], registers[b])
+                taken = condition if mask is None else condition & mask
+                if not taken.any():
+                    continue
+                fallen = ~condition if mask is None else mask & ~condition
+                if not fallen.any():
+                    pc = c
+                    continue
+                # the lanes part ways
+                pcs = np.where(taken, c, np.where(fallen, pc, pcs))
+                pc, mask, resume = self.select(pcs)
+                continue
+            else:
+                value = operations[opcode](registers[a], registers[b])
+            registers[c] = value if mask is None else np.where(mask, value, registers[c])
+            if stopped:
+                stopped = False
+                pcs = np.where(mask, pc, pcs)
+                pc, mask, resume = self.select(pcs)
+        return steps
+
+    def report(self) -> str:
+        rate = self.steps * self.lanes / self.seconds if self.seconds > 0 else 0.0
+        return (f'{self.steps} quaternions issued over {self.lanes} lanes in {self.seconds * 1000:.3f} ms, '
+                f'{rate:,.0f} lane quaternions per second')
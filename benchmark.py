@@ -0,0 +1,178 @@
+from argparse import ArgumentParser
+import random
+import shutil
+import sys
+import time
+from tempfile import TemporaryDirectory
+from elements import Terminal
+from lexer import Lexer, TokenStream
+from parser import Parser
+from quaternizer import Quaternizer
+from optimizer import PassManager
+from vm import Program, VirtualMachine, VMException
+from pybackend import compile_program
+from batch import BatchMachine, declared_names
+from cbackend import NativeProgram
+from tpcc_types.names import NameTable
+from tpcc_types.parser import BinaryExpressionNode, ExpressionBaseNode
+
+# Expressions the recursive expression parser can handle (it hangs on chains of equal precedence operators).
+EXPRESSIONS = ['a * b + c', 'a / b - c * d', 'a < b and c > d or e = f', 'a + b * c', 'a', 'a <= 10']
+
+
+def time_it(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_lexer(input_files: list[str], repeat: int):
+    for input_file in input_files:
+        regex_lexemes = Lexer(input_file).lexemes
+        legacy_lexemes = Lexer(input_file, legacy=True).lexemes
+        if regex_lexemes != legacy_lexemes:
+            print(f'{input_file}: lexeme streams differ', file=sys.stderr)
+            exit(1)
+        regex_time = time_it(lambda: Lexer(input_file), repeat)
+        legacy_time = time_it(lambda: Lexer(input_file, legacy=True), repeat)
+        print(f'{input_file}: {len(regex_lexemes)} lexemes, '
+              f'legacy {legacy_time * 1000:.3f}ms, regex {regex_time * 1000:.3f}ms, '
+              f'speedup {legacy_time / regex_time:.1f}x')
+
+
+def dump_expression(node: ExpressionBaseNode):
+    if type(node) is BinaryExpressionNode:
+        return node.operator, dump_expression(node.left), dump_expression(node.right)
+    return node.value
+
+
+def parse_expressions(tokens: TokenStream, count: int, recursive: bool = False):
+    parser = Parser(tokens)
+    nodes = list()
+    for _ in range(count):
+        if recursive:
+            nodes.append(parser._parse_expression(parser.parse_primary(), 0))
+        else:
+            nodes.append(parser.parse_expression())
+        parser.eat_token()  # parse_expression() does not eat the last token of an expression
+        parser.eat_token(Terminal.SCOLON)
+    return nodes
+
+
+def bench_expression(count: int, repeat: int):
+    expressions = [EXPRESSIONS[i % len(EXPRESSIONS)] for i in range(count)]
+    tokens = TokenStream(' ;\n'.join(expressions) + ' ;\nend ;\n')
+    iterative_nodes = parse_expressions(tokens, count)
+    recursive_nodes = parse_expressions(tokens, count, recursive=True)
+    if list(map(dump_expression, iterative_nodes)) != list(map(dump_expression, recursive_nodes)):
+        print('expression trees differ', file=sys.stderr)
+        exit(1)
+    iterative_time = time_it(lambda: parse_expressions(tokens, count), repeat)
+    recursive_time = time_it(lambda: parse_expressions(tokens, count, recursive=True), repeat)
+    print(f'{count} mixed expressions: recursive {count / recursive_time:.0f}/s, '
+          f'iterative {count / iterative_time:.0f}/s, speedup {recursive_time / iterative_time:.1f}x')
+
+    # the recursive parser never returns on these
+    terms = count
+    tokens = TokenStream(' + '.join('a' for _ in range(terms)) + ' ;\nend ;\n')
+    iterative_time = time_it(lambda: parse_expressions(tokens, 1), repeat)
+    print(f'a + a + ... ({terms} terms): iterative {terms / iterative_time:.0f} terms/s')
+
+
+def bench_execute(input_files: list[str], repeat: int, level: int, limit: int):
+    for input_file in input_files:
+        names = NameTable()
+        nodes = Parser(TokenStream.from_file(input_file), names).parse()
+        ir = PassManager.from_level(level).run(Quaternizer(nodes, names).generate())
+        machine = VirtualMachine(Program(ir), limit)
+        try:
+            machine.run()
+        except VMException as exception:
+            print(f'{input_file}: skipped, {exception}')
+            continue
+        start = time.perf_counter()
+        compiled = compile_program(ir)
+        compile_time = time.perf_counter() - start
+        if machine.run() != compiled.run():
+            print(f'{input_file}: backends disagree', file=sys.stderr)
+            exit(1)
+        vm_time = time_it(machine.run, repeat)
+        python_time = time_it(compiled.run, repeat)
+        native_report = ''
+        # the C backend only with a compiler around, built every time to time the compiler too
+        if shutil.which('cc') is not None:
+            with TemporaryDirectory() as directory:
+                native = NativeProgram(ir, directory=directory)
+                if machine.run() != native.run():
+                    print(f'{input_file}: vm and c disagree', file=sys.stderr)
+                    exit(1)
+                native_time = time_it(native.run, repeat)
+            native_report = (f', c {native_time * 1000:.3f}ms (built in {native.build_seconds * 1000:.3f}ms), '
+                             f'speedup {vm_time / native_time:.1f}x')
+        print(f'{input_file}: {machine.steps} quaternions executed, vm {vm_time * 1000:.3f}ms, '
+              f'python {python_time * 1000:.3f}ms (compiled in {compile_time * 1000:.3f}ms), '
+              f'speedup {vm_time / python_time:.1f}x{native_report}')
+
+
+def bench_batch(input_files: list[str], repeat: int, level: int, limit: int, lanes: int):
+    for input_file in input_files:
+        names = NameTable()
+        parser = Parser(TokenStream.from_file(input_file), names)
+        nodes = parser.parse()
+        program = Program(PassManager.from_level(level).run(Quaternizer(nodes, names).generate()))
+        machine = BatchMachine(program, declared_names(parser.declarations), limit)
+        # small values, for loops to end, and a few lanes dividing by zero
+        generator = random.Random(0)
+        table = {name: [generator.randint(-10, 10) for _ in range(lanes)] for name in machine.columns}
+        rows = [{name: column[lane] for name, column in table.items()} for lane in range(lanes)]
+
+        def run_lanes():
+            results = list()
+            for row in rows:
+                try:
+                    results.append(VirtualMachine(program, limit).run(row))
+                except VMException as exception:
+                    if 'Division by zero' not in str(exception):
+                        raise
+                    results.append(None)
+            return results
+
+        try:
+            expected = run_lanes()
+        except VMException as exception:
+            print(f'{input_file}: skipped, {exception}')
+            continue
+        columns = machine.run(table)
+        for lane, variables in enumerate(expected):
+            if (variables is None) != bool(machine.failed[lane]) or variables is not None and any(
+                    columns[name][lane] != value for name, value in variables.items()):
+                print(f'{input_file}: batch and vm disagree on lane {lane}', file=sys.stderr)
+                exit(1)
+        vm_time = time_it(run_lanes, repeat)
+        batch_time = time_it(lambda: machine.run(table), repeat)
+        print(f'{input_file}: {lanes} lanes, {machine.steps} quaternions issued, vm {vm_time * 1000:.3f}ms, '
+              f'batch {batch_time * 1000:.3f}ms, speedup {vm_time / batch_time:.1f}x')
+
+
+arg_parser = ArgumentParser(description='tpcc benchmarks')
+arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of runs, the best one is reported')
+arg_parser.add_argument('-n', '--count', type=int, default=10000, help='Number of generated expressions')
+arg_parser.add_argument('-O', '--optimize', type=int, default=0, help='Optimization level of quaternions, for the execute and batch benchmarks')
+arg_parser.add_argument('--limit', type=int, default=10 ** 6, help='Number of quaternions after which a program is deemed not to terminate, for the execute and batch benchmarks')
+arg_parser.add_argument('--lanes', type=int, default=1000, help='Number of input rows, for the batch benchmark')
+arg_parser.add_argument('benchmark', choices=['lexer', 'expression', 'execute', 'batch'], help='Benchmark to run')
+arg_parser.add_argument('input_files', nargs='*', help='Input file(s), for the lexer, execute and batch benchmarks')
+
+if __name__ == '__main__':
+    args = arg_parser.parse_args()
+    if args.benchmark == 'lexer':
+        bench_lexer(args.input_files, args.repeat)
+    elif args.benchmark == 'expression':
+        bench_expression(args.count, args.repeat)
+    elif args.benchmark == 'execute':
+        bench_execute(args.input_files, args.repeat, args.optimize, args.limit)
+    elif args.benchmark == 'batch':
+        bench_batch(args.input_files, args.repeat, args.optimize, args.limit, args.lanes)
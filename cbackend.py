@@ -0,0 +1,224 @@
+import ctypes
+import os
+import shutil
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence
+from tpcc_types.quaternion import *
+from pybackend import program_hash, variable_names
+from vm import VMException
+
+C_OPERATORS = {
+    Opcode.ADD: '+', Opcode.SUB: '-', Opcode.MUL: '*', Opcode.SHL: '<<',
+    Opcode.JEQ: '==', Opcode.JNE: '!=', Opcode.JGT: '>', Opcode.JLT: '<', Opcode.JGE: '>=', Opcode.JLE: '<=',
+}
+
+# what the translated function returns
+FINISHED = 0
+DIVISION_BY_ZERO = 1
+STOPPED = 2
+
+
+class CTranslator:
+    """
+    Translates an IR to a C translation unit defining one function,
+    int function_name(int32_t *variables, int64_t limit).
+    Variables and temporaries become int32_t locals, quaternion positions become labels and jumps
+    become gotos. Variables are read from and written back to the array, in the order of variable_names():
+    the declared ones first, even those the quaternions do not use anymore.
+    Arithmetic goes through uint32_t to wrap around instead of overflowing. The function returns
+    DIVISION_BY_ZERO, or STOPPED after limit jumps backwards if limit is not negative, and FINISHED otherwise.
+    """
+    ir: QuaternionIR
+    lines: List[str]
+
+    def __init__(self, ir: QuaternionIR, declared: Sequence[str] = (), function_name: str = 'tpcc_run'):
+        self.ir = ir
+        self.declared = declared
+        self.function_name = function_name
+        self.variables = variable_names(ir, declared)
+        self.lines = list()
+
+    def operand(self, operand: int) -> str:
+        kind = operand_kind(operand)
+        if kind == OperandKind.CONST:
+            value = operand_value(operand)
+            # -2147483648 would be the negation of a constant too large for an int
+            return 'INT32_MIN' if value == INT_MIN else str(value)
+        if kind == OperandKind.VAR:
+            return f'v_{self.ir.format_operand(operand)}'
+        return self.ir.format_operand(operand)
+
+    def label(self, index: int) -> str:
+        return 'done' if index >= len(self.ir) else f'q{self.ir.base + index + 1}'
+
+    def translate(self) -> str:
+        ir = self.ir
+        count = len(ir)
+        targets = set()
+        backwards = False
+        temporaries = dict()
+        for index in range(count):
+            if ir.opcodes[index] in JUMP_OPCODES:
+                dest = operand_value(ir.results[index]) - 1 - ir.base
+                if not 0 <= dest <= count:
+                    raise VMException(f'Jump out of the program: ({ir.base + index + 1}) {ir.format(index)}')
+                targets.add(dest)
+                backwards |= dest <= index
+            for operand in (ir.lhs[index], ir.rhs[index], ir.results[index]):
+                if operand_kind(operand) == OperandKind.TEMP:
+                    temporaries.setdefault(operand_value(operand), None)
+
+        lines = self.lines = [
+            f'/* tpcc program {program_hash(ir, self.declared)} */',
+            '#include <stdint.h>',
+            '',
+            f'int {self.function_name}(int32_t *variables, int64_t limit)',
+            '{',
+        ]
+        for position, name in enumerate(self.variables):
+            lines.append(f'    int32_t v_{name} = variables[{position}];')
+        for value in sorted(temporaries):
+            lines.append(f'    int32_t t{value} = 0;')
+        lines.append(f'    int status = {FINISHED};')
+        if backwards:
+            lines.append('    int64_t budget = limit < 0 ? INT64_MAX : limit;')
+        lines.append('')
+        for index in range(count):
+            if index in targets:
+                lines.append(f'{self.label(index)}:')
+            lines.append(f'    {self.statement(index)}')
+        lines.append('done:')
+        for position, name in enumerate(self.variables):
+            lines.append(f'    variables[{position}] = v_{name};')
+        lines.append('    return status;')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def statement(self, index: int) -> str:
+        ir = self.ir
+        opcode = ir.opcodes[index]
+        lhs, rhs, result = ir.lhs[index], ir.rhs[index], ir.results[index]
+        if opcode in JUMP_OPCODES:
+            dest = operand_value(result) - 1 - ir.base
+            goto = f'goto {self.label(dest)};'
+            if dest <= index:
+                # every loop jumps backwards, counting those jumps stops the programs not terminating
+                goto = f'{{ if (--budget < 0) {{ status = {STOPPED}; goto done; }} {goto} }}'
+            if opcode == Opcode.JUMP:
+                return goto
+            return f'if ({self.operand(lhs)} {C_OPERATORS[opcode]} {self.operand(rhs)}) {goto}'
+        target = self.operand(result)
+        a = self.operand(lhs)
+        if opcode == Opcode.ASSIGN:
+            return f'{target} = {a};'
+        b = self.operand(rhs)
+        if opcode == Opcode.DIV:
+            if operand_kind(rhs) == OperandKind.CONST:
+                if operand_value(rhs) == 0:
+                    return f'{{ status = {DIVISION_BY_ZERO}; goto done; }}'
+                if operand_value(rhs) == -1:
+                    return f'{target} = (int32_t)(0u - (uint32_t){a});'
+                return f'{target} = {a} / {b};'
+            # C division truncates toward zero too, but INT32_MIN / -1 overflows
+            return (f'if ({b} == 0) {{ status = {DIVISION_BY_ZERO}; goto done; }} '
+                    f'{target} = {b} == -1 ? (int32_t)(0u - (uint32_t){a}) : {a} / {b};')
+        if opcode == Opcode.SHL:
+            if operand_kind(rhs) == OperandKind.CONST and not 0 <= operand_value(rhs) < INT_BITS:
+                return f'{target} = 0;'
+            return f'{target} = (uint32_t){b} < {INT_BITS} ? (int32_t)((uint32_t){a} << {b}) : 0;'
+        return f'{target} = (int32_t)((uint32_t){a} {C_OPERATORS[opcode]} (uint32_t){b});'
+
+
+def cache_directory() -> str:
+    """
+    Where built programs are kept across runs: $TPCC_CACHE, or tpcc in the user cache directory.
+    """
+    directory = os.environ.get('TPCC_CACHE')
+    if directory is None:
+        directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'tpcc')
+    return directory
+
+
+class NativeProgram:
+    """
+    An IR translated to C and built by the system compiler into a shared object, which is loaded through
+    ctypes. Built objects are cached on disk by the hash of the IR, and rebuilt when the translation changes.
+    """
+    source: str
+    path: str
+    variables: List[str]
+    values: Dict[str, int]  # the values of the variables after the last run
+    seconds: float
+    build_seconds: float
+
+    def __init__(self, ir: QuaternionIR, declared: Sequence[str] = (), compiler: Optional[str] = None,
+                 directory: Optional[str] = None, limit: Optional[int] = None):
+        translator = CTranslator(ir, declared)
+        self.source = translator.translate()
+        self.variables = translator.variables
+        self.limit = limit
+        self.values = dict()
+        self.seconds = 0.0
+        directory = directory if directory is not None else cache_directory()
+        self.path = os.path.join(directory, f'{program_hash(ir, declared)}.so')
+        start = time.perf_counter()
+        self.build(compiler if compiler is not None else os.environ.get('CC', 'cc'))
+        self.build_seconds = time.perf_counter() - start
+        self.function = getattr(ctypes.CDLL(os.path.abspath(self.path)), translator.function_name)
+        self.function.argtypes = (ctypes.POINTER(ctypes.c_int32), ctypes.c_int64)
+        self.function.restype = ctypes.c_int
+
+    def build(self, compiler: str):
+        source_path = self.path[:-len('.so')] + '.c'
+        if os.path.exists(self.path) and os.path.exists(source_path):
+            with open(source_path) as source_file:
+                if source_file.read() == self.source:
+                    return
+        if shutil.which(compiler) is None:
+            raise VMException(f'C compiler not found: {compiler}')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # built under names of this process, then renamed: concurrent builds of a program do not clash
+        suffix = f'.{os.getpid()}'
+        with open(source_path + suffix, 'w') as source_file:
+            source_file.write(self.source)
+        command = [compiler, '-O2', '-shared', '-fPIC', '-x', 'c', '-o', self.path + suffix, source_path + suffix]
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode != 0:
+            os.remove(source_path + suffix)
+            raise VMException(f'{" ".join(command)} failed:\n{process.stderr}')
+        os.replace(self.path + suffix, self.path)
+        os.replace(source_path + suffix, source_path)
+
+    def run(self, variables: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        variables = variables or dict()
+        values = (ctypes.c_int32 * len(self.variables))(*(wrap_int(variables.get(name, 0)) for name in self.variables))
+        limit = self.limit if self.limit is not None else -1
+        start = time.perf_counter()
+        try:
+            status = self.function(values, limit)
+        finally:
+            self.seconds = time.perf_counter() - start
+        self.values = dict(zip(self.variables, values))
+        if status == DIVISION_BY_ZERO:
+            raise VMException('Division by zero')
+        if status == STOPPED:
+            raise VMException(f'Stopped after {limit} jumps backwards')
+        return self.values
+
+    def report(self) -> str:
+        return f'ran in {self.seconds * 1000:.3f} ms, built in {self.build_seconds * 1000:.3f} ms'
+
+
+NATIVE: Dict[str, NativeProgram] = dict()
+
+
+def compile_native(ir: QuaternionIR, declared: Sequence[str] = ()) -> NativeProgram:
+    """
+    The NativeProgram of ir, loaded only the first time the same program is seen.
+    """
+    key = program_hash(ir, declared)
+    program = NATIVE.get(key)
+    if program is None:
+        program = NATIVE[key] = NativeProgram(ir, declared)
+    return program
@@ -0,0 +1,309 @@
+from array import array
+from typing import Dict, List, Optional, Tuple
+from tpcc_types.quaternion import *
+
+
+def block_starts(ir: QuaternionIR) -> bytearray:
+    """
+    Flags the first quaternion of every basic block: the first one, jump destinations,
+    and the ones right after jumps.
+    """
+    count = len(ir)
+    starts = bytearray(count)
+    if count:
+        starts[0] = 1
+    opcodes = ir.opcodes
+    results = ir.results
+    for index in range(count):
+        if opcodes[index] in JUMP_OPCODES:
+            if index + 1 < count:
+                starts[index + 1] = 1
+            dest = operand_value(results[index]) - 1 - ir.base
+            if 0 <= dest < count:
+                starts[dest] = 1
+    return starts
+
+
+def compact(ir: QuaternionIR, keep) -> QuaternionIR:
+    """
+    Copies the quaternions flagged in keep to a new IR, and renumbers the jump destinations.
+    A jump to a removed quaternion goes to the next one kept.
+    """
+    return splice(ir, keep)[0]
+
+
+def splice(ir: QuaternionIR, keep, inserted: Optional[Dict[int, List[Tuple[int, int, int, int]]]] = None,
+           appended: Optional[Dict[int, List[Tuple[int, int, int, int]]]] = None):
+    """
+    Like compact(), but also inserts the (opcode, lhs, rhs, result) quaternions of inserted[index]
+    right before index, so that jumps to index land on them, and the ones of appended[index] right
+    after index. Destinations of the new quaternions are not renumbered. Returns the new IR, and the
+    new index of every old index (of the next one kept, for a removed one) and of the end.
+    """
+    inserted = inserted or dict()
+    appended = appended or dict()
+    count = len(ir)
+    # where jumps to every old index, and to the end of the IR, land
+    landing = array('q', bytes(8 * (count + 1)))
+    moved = array('q', bytes(8 * (count + 1)))
+    kept = 0
+    for index in range(count + 1):
+        landing[index] = kept
+        kept += len(inserted.get(index, ()))
+        moved[index] = kept
+        if index < count:
+            kept += keep[index] + len(appended.get(index, ()))
+
+    result = QuaternionIR(ir.names, ir.base)
+    base = ir.base
+    for index in range(count + 1):
+        for quaternion in inserted.get(index, ()):
+            result.append(*quaternion)
+        if index == count:
+            break
+        if keep[index]:
+            opcode = ir.opcodes[index]
+            dest = ir.results[index]
+            if opcode in JUMP_OPCODES and operand_kind(dest) == OperandKind.LABEL:
+                dest_index = operand_value(dest) - 1 - base
+                if 0 <= dest_index <= count:
+                    dest = label_operand(base + landing[dest_index] + 1)
+            result.append(opcode, ir.lhs[index], ir.rhs[index], dest)
+        for quaternion in appended.get(index, ()):
+            result.append(*quaternion)
+    return result, moved
+
+
+def jump_dest(ir: QuaternionIR, index: int) -> int:
+    """
+    The index of the destination of the jump at index, len(ir) for the end of the program.
+    """
+    return operand_value(ir.results[index]) - 1 - ir.base
+
+
+class BasicBlock:
+    """
+    The quaternions [start, end) of an IR, entered only at start and left only after end - 1.
+    Successors and predecessors are block ids.
+    """
+    __slots__ = ('id', 'start', 'end', 'successors', 'predecessors')
+
+    def __init__(self, block_id: int, start: int, end: int):
+        self.id = block_id
+        self.start = start
+        self.end = end
+        self.successors = list()
+        self.predecessors = list()
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f'BasicBlock({self.id}, [{self.start}, {self.end}), successors={self.successors})'
+
+
+class Loop:
+    """
+    A natural loop: its header block, and the blocks that reach the sources of its back edges
+    without going through the header. Loops sharing a header are merged.
+    """
+    __slots__ = ('header', 'blocks', 'back_edges')
+
+    def __init__(self, header: int):
+        self.header = header
+        self.blocks = {header}
+        self.back_edges = list()  # source block ids
+
+    def __repr__(self):
+        return f'Loop(header={self.header}, blocks={sorted(self.blocks)})'
+
+
+class ControlFlowGraph:
+    """
+    The basic blocks of an IR in program order, followed by an empty exit block for the end of the program.
+    Block 0 is the entry.
+    """
+    ir: QuaternionIR
+    blocks: List[BasicBlock]
+    block_of: array  # the block id of every quaternion index, and of len(ir) for the exit
+
+    def __init__(self, ir: QuaternionIR):
+        self.ir = ir
+        count = len(ir)
+        self.blocks = list()
+        self.block_of = array('l', bytes(array('l').itemsize * (count + 1)))
+        starts = block_starts(ir)
+        start = 0
+        for index in range(1, count + 1):
+            if index == count or starts[index]:
+                self.add_block(start, index)
+                start = index
+        self.exit = self.add_block(count, count)
+
+        opcodes = ir.opcodes
+        for block in self.blocks:
+            if block is self.exit:
+                continue
+            last = block.end - 1
+            targets = list()
+            if opcodes[last] != Opcode.JUMP:
+                targets.append(self.block_of[block.end])
+            if opcodes[last] in JUMP_OPCODES:
+                dest = self.block_of[min(max(jump_dest(ir, last), 0), count)]
+                if dest not in targets:
+                    targets.append(dest)
+            for target in targets:
+                block.successors.append(target)
+                self.blocks[target].predecessors.append(block.id)
+
+    def add_block(self, start: int, end: int) -> BasicBlock:
+        block = BasicBlock(len(self.blocks), start, end)
+        self.blocks.append(block)
+        for index in range(start, end):
+            self.block_of[index] = block.id
+        if start == end:
+            self.block_of[end] = block.id
+        return block
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def reverse_postorder(self) -> List[int]:
+        """
+        The blocks reachable from the entry, in reverse postorder of a depth-first search.
+        """
+        order = list()
+        seen = bytearray(len(self.blocks))
+        seen[0] = 1
+        stack = [(0, iter(self.blocks[0].successors))]
+        while stack:
+            block_id, successors = stack[-1]
+            for successor in successors:
+                if not seen[successor]:
+                    seen[successor] = 1
+                    stack.append((successor, iter(self.blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block_id)
+        order.reverse()
+        return order
+
+    def dominators(self) -> List[int]:
+        """
+        The immediate dominator of every block, -1 for unreachable ones and the entry itself
+        for the entry, by the iterative algorithm of Cooper, Harvey and Kennedy.
+        """
+        order = self.reverse_postorder()
+        number = [-1] * len(self.blocks)
+        for position, block_id in enumerate(order):
+            number[block_id] = position
+        idom = [-1] * len(self.blocks)
+        idom[0] = 0
+
+        def intersect(a: int, b: int) -> int:
+            while a != b:
+                while number[a] > number[b]:
+                    a = idom[a]
+                while number[b] > number[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block_id in order[1:]:
+                new_idom = -1
+                for predecessor in self.blocks[block_id].predecessors:
+                    if idom[predecessor] != -1:
+                        new_idom = predecessor if new_idom == -1 else intersect(predecessor, new_idom)
+                if idom[block_id] != new_idom:
+                    idom[block_id] = new_idom
+                    changed = True
+        return idom
+
+    @staticmethod
+    def dominates(idom: List[int], a: int, b: int) -> bool:
+        """
+        Whether block a dominates block b, given the immediate dominators from dominators().
+        """
+        while b != a:
+            parent = idom[b]
+            if parent == -1 or parent == b:
+                return False
+            b = parent
+        return True
+
+    def loops(self, idom: Optional[List[int]] = None) -> List[Loop]:
+        """
+        The natural loops, found from the back edges: edges to a block dominating their source.
+        """
+        if idom is None:
+            idom = self.dominators()
+        loops: Dict[int, Loop] = dict()
+        for block in self.blocks:
+            if idom[block.id] == -1:
+                continue
+            for successor in block.successors:
+                if not self.dominates(idom, successor, block.id):
+                    continue
+                loop = loops.get(successor)
+                if loop is None:
+                    loop = loops[successor] = Loop(successor)
+                loop.back_edges.append(block.id)
+                stack = [block.id]
+                while stack:
+                    block_id = stack.pop()
+                    if block_id not in loop.blocks:
+                        loop.blocks.add(block_id)
+                        stack.extend(self.blocks[block_id].predecessors)
+        return list(loops.values())
+
+    def reachable(self) -> bytearray:
+        """
+        Flags the blocks reachable from the entry.
+        """
+        seen = bytearray(len(self.blocks))
+        seen[0] = 1
+        stack = [0]
+        while stack:
+            for successor in self.blocks[stack.pop()].successors:
+                if not seen[successor]:
+                    seen[successor] = 1
+                    stack.append(successor)
+        return seen
+
+
+def has_preheader_room(graph: ControlFlowGraph, loop: Loop) -> bool:
+    """
+    Whether a preheader can go right before the header of loop: the header is not
+    entered by falling through from a block of the loop.
+    """
+    start = graph.blocks[loop.header].start
+    return start == 0 or graph.block_of[start - 1] not in loop.blocks or graph.ir.opcodes[start - 1] == Opcode.JUMP
+
+
+def insert_preheaders(graph: ControlFlowGraph, keep, preheaders: List[Tuple[Loop, list]],
+                      appended: Optional[Dict[int, list]] = None) -> QuaternionIR:
+    """
+    Splices the IR of graph like splice(), with a preheader holding the given quaternions right before
+    the header of each loop, which must have room for it. Jumps entering the loop go to the preheader,
+    while the back edges still go to the header.
+    """
+    ir = graph.ir
+    inserted = dict()
+    back_jumps = list()  # (index of a back edge jump, index of its header)
+    for loop, quaternions in preheaders:
+        header_start = graph.blocks[loop.header].start
+        inserted[header_start] = quaternions
+        for block_id in loop.back_edges:
+            last = graph.blocks[block_id].end - 1
+            if ir.opcodes[last] in JUMP_OPCODES and jump_dest(ir, last) == header_start:
+                back_jumps.append((last, header_start))
+    result, moved = splice(ir, keep, inserted, appended)
+    for jump, header_start in back_jumps:
+        result.results[moved[jump]] = label_operand(result.base + moved[header_start] + 1)
+    return result
@@ -65,6 +65,12 @@ Operator = [Terminal.MULT, Terminal.PLUS, Terminal.MINUS, Terminal.DIV, Terminal
 Parens = [Terminal.LPAREN, Terminal.RPAREN, Terminal.LBRACK, Terminal.RBRACK]
 
 
+# Terminals numbered in definition order, for compact (array based) storage.
+TERMINALS = tuple(Terminal)
+
+TERMINAL_ID = {terminal: terminal_id for terminal_id, terminal in enumerate(TERMINALS)}
+
+
 
 class Nonterminal(Enum):
     """
@@ -118,3 +124,9 @@ class Nonterminal(Enum):
     OUTPUTLST = "N_OUTPUTLST"
     PROCIDENT = "N_PROCIDENT"
     PROCSTMT = "N_PROCSTMT"
+    PROGEND = "N_PROGEND"
+    REPEAT = "N_REPEAT"
+    ORLST = "N_ORLST"
+    ANDEXPR = "N_ANDEXPR"
+    ANDLST = "N_ANDLST"
+    RELOPLST = "N_RELOPLST"
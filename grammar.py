@@ -0,0 +1,100 @@
+from enum import Enum
+from elements import Terminal as VT, Nonterminal as VN
+
+
+class Action(Enum):
+    """
+    A semantic action, run by the LL(1) parser when it is popped from the parse stack.
+    Actions build AST nodes on the value stack, from the last matched token and the values below.
+    """
+    PROGRAM = "A_PROGRAM"
+    DISCARD = "A_DISCARD"
+    EMIT = "A_EMIT"
+    NAMES = "A_NAMES"
+    NAME = "A_NAME"
+    DECLARATION = "A_DECLARATION"
+    LIST = "A_LIST"
+    APPEND = "A_APPEND"
+    ASSIGN = "A_ASSIGN"
+    IF = "A_IF"
+    WHILE = "A_WHILE"
+    REPEAT = "A_REPEAT"
+    READ = "A_READ"
+    WRITE = "A_WRITE"
+    IDENTIFIER = "A_IDENTIFIER"
+    NUMBER = "A_NUMBER"
+    OPERATOR = "A_OPERATOR"
+    BINARY = "A_BINARY"
+
+
+START = VN.PROG
+
+# The grammar accepted by Parser, as (nonterminal, right-hand side) productions.
+# Operator precedences match parser.BINARY_OPERATORS, lowest (or) to highest (relational operators).
+PRODUCTIONS = [
+    (VN.PROG, (VT.PROG, VT.IDENT, Action.PROGRAM, VT.SCOLON, VN.VARDEC, Action.DISCARD,
+               VN.PROCHDR, VT.BEGIN, VN.STMTPART, VT.END, VN.PROGEND)),
+    (VN.PROCHDR, (VT.PROC, VT.IDENT, VT.SCOLON)),
+    # top-level statements are emitted one by one
+    (VN.STMTPART, (VN.STMT, Action.EMIT, VN.STMTPART)),
+    (VN.STMTPART, ()),
+    (VN.PROGEND, (VT.SCOLON,)),
+    (VN.PROGEND, (VT.DOT,)),
+    (VN.PROGEND, ()),
+
+    (VN.VARDEC, (VT.VAR, VT.IDENT, Action.NAMES, VN.IDENTLST, VT.COLON, VN.TYPE, VT.SCOLON, Action.DECLARATION)),
+    (VN.IDENTLST, (VT.COMMA, VT.IDENT, Action.NAME, VN.IDENTLST)),
+    (VN.IDENTLST, ()),
+    (VN.TYPE, (VT.INT,)),
+
+    (VN.STMT, (VN.ASSIGN,)),
+    (VN.STMT, (VN.CONDITION,)),
+    (VN.STMT, (VN.WHILE,)),
+    (VN.STMT, (VN.REPEAT,)),
+    (VN.STMT, (VN.READ,)),
+    (VN.STMT, (VN.WRITE,)),
+    (VN.STMT, (VN.VARDEC,)),
+    # a single statement, or a begin ... end. block
+    (VN.COMPOUND, (VT.BEGIN, Action.LIST, VN.STMTLST, VT.END, VT.DOT)),
+    (VN.COMPOUND, (Action.LIST, VN.STMT, Action.APPEND)),
+    (VN.STMTLST, (VN.STMT, Action.APPEND, VN.STMTLST)),
+    (VN.STMTLST, ()),
+
+    (VN.ASSIGN, (VT.IDENT, Action.IDENTIFIER, VT.ASSIGN, VN.EXPR, VT.SCOLON, Action.ASSIGN)),
+    # the else part binds to the nearest if
+    (VN.CONDITION, (VT.IF, VN.EXPR, VT.THEN, VN.COMPOUND, VN.ELSEPART, Action.IF)),
+    (VN.ELSEPART, (VT.ELSE, VN.COMPOUND)),
+    (VN.ELSEPART, (Action.LIST,)),
+    (VN.WHILE, (VT.WHILE, VN.EXPR, VT.DO, VN.COMPOUND, Action.WHILE)),
+    (VN.REPEAT, (VT.REPEAT, VN.COMPOUND, VT.UNTIL, VN.EXPR, VT.SCOLON, Action.REPEAT)),
+    (VN.READ, (VT.READ, VT.IDENT, Action.IDENTIFIER, VT.SCOLON, Action.READ)),
+    (VN.WRITE, (VT.WRITE, VN.EXPR, VT.SCOLON, Action.WRITE)),
+
+    (VN.EXPR, (VN.ANDEXPR, VN.ORLST)),
+    (VN.ORLST, (VT.OR, Action.OPERATOR, VN.ANDEXPR, Action.BINARY, VN.ORLST)),
+    (VN.ORLST, ()),
+    (VN.ANDEXPR, (VN.SIMPLEEXPR, VN.ANDLST)),
+    (VN.ANDLST, (VT.AND, Action.OPERATOR, VN.SIMPLEEXPR, Action.BINARY, VN.ANDLST)),
+    (VN.ANDLST, ()),
+    (VN.SIMPLEEXPR, (VN.TERM, VN.ADDOPLST)),
+    (VN.ADDOPLST, (VN.ADDOP, VN.TERM, Action.BINARY, VN.ADDOPLST)),
+    (VN.ADDOPLST, ()),
+    (VN.ADDOP, (VT.PLUS, Action.OPERATOR)),
+    (VN.ADDOP, (VT.MINUS, Action.OPERATOR)),
+    (VN.TERM, (VN.FACTOR, VN.MULTOPLST)),
+    (VN.MULTOPLST, (VN.MULTOP, VN.FACTOR, Action.BINARY, VN.MULTOPLST)),
+    (VN.MULTOPLST, ()),
+    (VN.MULTOP, (VT.MULT, Action.OPERATOR)),
+    (VN.MULTOP, (VT.DIV, Action.OPERATOR)),
+    (VN.FACTOR, (VN.CONST, VN.RELOPLST)),
+    (VN.RELOPLST, (VN.RELOP, VN.CONST, Action.BINARY, VN.RELOPLST)),
+    (VN.RELOPLST, ()),
+    (VN.RELOP, (VT.EQ, Action.OPERATOR)),
+    (VN.RELOP, (VT.NE, Action.OPERATOR)),
+    (VN.RELOP, (VT.LT, Action.OPERATOR)),
+    (VN.RELOP, (VT.GT, Action.OPERATOR)),
+    (VN.RELOP, (VT.LE, Action.OPERATOR)),
+    (VN.RELOP, (VT.GE, Action.OPERATOR)),
+    (VN.CONST, (VT.IDENT, Action.IDENTIFIER)),
+    (VN.CONST, (VT.INTCONST, Action.NUMBER)),
+]
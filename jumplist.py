@@ -0,0 +1,68 @@
+from typing import Iterator
+
+
+class PatchSite:
+    """
+    The position of a jump quaternion whose destination is not known yet,
+    linked to the next one waiting for the same destination.
+    """
+    __slots__ = ("pos", "next")
+
+    def __init__(self, pos: int):
+        self.pos = pos
+        self.next = None
+
+
+class JumpList:
+    """
+    Jump quaternions waiting for the same destination, as a singly linked list
+    with both ends kept, so that two lists are merged in constant time.
+    """
+    __slots__ = ("head", "tail")
+
+    def __init__(self, *positions: int):
+        self.head = None
+        self.tail = None
+        for pos in positions:
+            self.append(pos)
+
+    def __bool__(self):
+        return self.head is not None
+
+    def __iter__(self) -> Iterator[int]:
+        site = self.head
+        while site is not None:
+            yield site.pos
+            site = site.next
+
+    def __repr__(self):
+        return f"JumpList{tuple(self)}"
+
+    def append(self, pos: int):
+        site = PatchSite(pos)
+        if self.tail is None:
+            self.head = site
+        else:
+            self.tail.next = site
+        self.tail = site
+
+    def extend(self, other: "JumpList") -> "JumpList":
+        """
+        Links the sites of other after the ones of self. The sites are shared,
+        so other must not be used on its own afterwards.
+        """
+        if other.head is not None:
+            if self.tail is None:
+                self.head = other.head
+            else:
+                self.tail.next = other.head
+            self.tail = other.tail
+        return self
+
+
+def merge(*lists: JumpList) -> JumpList:
+    result = JumpList()
+    for jumps in lists:
+        result.extend(jumps)
+    return result
+
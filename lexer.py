@@ -1,5 +1,8 @@
-from elements import Terminal
+from array import array
+from bisect import bisect_left, bisect_right
+from elements import Terminal, TERMINALS, TERMINAL_ID
 import re
+import sys
 
 # matches whitespace
 WHITESPACE = re.compile(r"\s")
@@ -31,6 +34,25 @@ CHARCONST = re.compile("\'.\'")
 # matches invalid character literals
 CHARCONST_INVALID = re.compile("^\'")
 
+# number of characters read at a time by the streaming lexer
+CHUNK_SIZE = 1 << 16
+
+# a lexeme ending this close to the end of a chunk may still grow, or be
+# matched differently (e.g. ' versus 'a'), once the next chunk is read
+CHUNK_MARGIN = 3
+
+# matches one lexeme (or a run of whitespace, or a comment) at a time,
+# following the same rules as the character-by-character scanner
+SCANNER = re.compile(r"""
+    (?P<whitespace>\s+)
+  | (?P<comment>\((?=\*)(?:.*?\*\)|.*))
+  | (?P<ident>[a-zA-Z_]\w*)
+  | (?P<intconst>\d+)
+  | (?P<charconst>'[^\n]'(?=.)|''|')
+  | (?P<operator>-[0-9]*|\.\.?|:=?|<[=>]?|>=?)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
 KEYWORDS = {
     ":=": Terminal.ASSIGN,
     "*": Terminal.MULT,
@@ -95,16 +117,220 @@ class MiplInvalidConst(Exception):
     pass
 
 
+def classify_lexeme(lexeme):
+    """
+    Classifies a lexeme as a terminal.
+    """
+
+    # recognize keywords and operators
+    if lexeme in KEYWORDS:
+        return KEYWORDS[lexeme]
+
+    # recognize identifiers
+    elif re.match(IDENT, lexeme):
+        return Terminal.IDENT
+
+    # recognize integer literals
+    elif re.match(INTCONST, lexeme):
+        if not (abs(int(lexeme, 10)) >> 31):
+            return Terminal.INTCONST
+        else:
+            raise MiplInvalidConst(f"**** invalid integer constant: {lexeme}")
+
+    # recognize character literals
+    elif re.match(CHARCONST, lexeme):
+        return Terminal.CHARCONST
+
+    # raise for invalid characters
+    elif re.match(CHARCONST_INVALID, lexeme):
+        raise MiplInvalidConst(f"**** invalid character constant: {lexeme}")
+
+    # otherwise, return unknown
+    else:
+        return Terminal.UNKNOWN
+
+
+class StreamToken:
+    """
+    A token of a TokenStream, its lexeme is only sliced from the source on access.
+    """
+    __slots__ = ("stream", "index")
+
+    def __init__(self, stream, index):
+        self.stream = stream
+        self.index = index
+
+    @property
+    def lexeme(self):
+        return self.stream.lexeme(self.index)
+
+    @property
+    def terminal(self):
+        return TERMINALS[self.stream.terminals[self.index]]
+
+    @property
+    def line_number(self):
+        return self.stream.line(self.index)
+
+    def __str__(self):
+        return f"TOKEN: {self.terminal.value} LEXEME: {self.lexeme} LINE: {self.line_number}"
+
+
+class TokenStream:
+    """
+    The tokens of a source text, stored as parallel array columns
+    (terminal id, start offset, end offset, line) instead of Token objects.
+    The offsets and lines of the tokens from shift_index on are stored without the pending
+    shift of the last edit, offset_delta and line_delta, read them through start(), end() and line().
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.terminals = array("i")
+        self.starts = array("i")
+        self.ends = array("i")
+        self.lines = array("i")
+        self.shift_index = 0
+        self.offset_delta = 0
+        self.line_delta = 0
+
+        self._scan(0, 1)
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename) as fin:
+            return cls(fin.read())
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self.terminals):
+            raise IndexError("token index out of range")
+        return StreamToken(self, index)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, index):
+        for index in range(index, len(self.terminals)):
+            yield StreamToken(self, index)
+
+    def lexeme(self, index):
+        return sys.intern(self.source[self.start(index):self.end(index)])
+
+    def start(self, index):
+        start = self.starts[index]
+        return start + self.offset_delta if index >= self.shift_index else start
+
+    def end(self, index):
+        end = self.ends[index]
+        return end + self.offset_delta if index >= self.shift_index else end
+
+    def line(self, index):
+        line = self.lines[index]
+        return line + self.line_delta if index >= self.shift_index else line
+
+    def end_index(self, offset):
+        """
+        The index of the first token ending after offset.
+        """
+        index = self.shift_index
+        if index and self.ends[index - 1] > offset:
+            return bisect_right(self.ends, offset, 0, index)
+        return bisect_right(self.ends, offset - self.offset_delta, index)
+
+    def move_shift(self, index):
+        """
+        Moves the pending shift to start at index, applying it to the tokens
+        in between: the cost is the distance between two edits, not the length of the tail.
+        """
+        low, high = sorted((self.shift_index, index))
+        sign = 1 if index > self.shift_index else -1
+        if self.offset_delta:
+            self.starts[low:high] = shift_column(self.starts[low:high], sign * self.offset_delta)
+            self.ends[low:high] = shift_column(self.ends[low:high], sign * self.offset_delta)
+        if self.line_delta:
+            self.lines[low:high] = shift_column(self.lines[low:high], sign * self.line_delta)
+        self.shift_index = index
+
+    def settle(self):
+        """
+        Applies the pending shift, so that the columns hold the actual offsets and lines.
+        """
+        self.move_shift(len(self))
+
+    def _scan(self, position, current_line):
+        """
+        Scans the source from position (which must be a lexeme boundary)
+        to its end and appends the tokens found.
+        """
+        terminals = self.terminals
+        starts = self.starts
+        ends = self.ends
+        lines = self.lines
+
+        for terminal_id, start, end, line in scan_tokens(self.source, position, current_line):
+            terminals.append(terminal_id)
+            starts.append(start)
+            ends.append(end)
+            lines.append(line)
+
+
+def shift_column(column, delta):
+    return array(column.typecode, map(delta.__add__, column))
+
+
+def scan_tokens(source, position=0, current_line=1):
+    """
+    Scans the source from position (which must be a lexeme boundary) and yields
+    a (terminal id, start offset, end offset, line) tuple for every token.
+    """
+    ident_id = TERMINAL_ID[Terminal.IDENT]
+    intconst_id = TERMINAL_ID[Terminal.INTCONST]
+
+    for match in SCANNER.finditer(source, position):
+        kind = match.lastgroup
+
+        # ignore whitespace and comments, but keep track of current line
+        if kind == "whitespace" or kind == "comment":
+            current_line += source.count("\n", match.start(), match.end())
+            continue
+
+        # identifiers and integers are common enough to skip the full classification
+        if kind == "ident":
+            lexeme = match.group()
+            terminal_id = TERMINAL_ID[KEYWORDS[lexeme]] if lexeme in KEYWORDS else ident_id
+        elif kind == "intconst":
+            lexeme = match.group()
+            if abs(int(lexeme, 10)) >> 31:
+                raise MiplInvalidConst(f"**** invalid integer constant: {lexeme}")
+            terminal_id = intconst_id
+        else:
+            terminal_id = TERMINAL_ID[classify_lexeme(match.group())]
+
+        yield terminal_id, match.start(), match.end(), current_line
+
+
 class Lexer:
     """
     Breaks an input file up into tokens and holds them for a parser.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, legacy=False, streaming=False, chunk_size=CHUNK_SIZE):
 
         self.debug_output = False
-
-        self._tokenize(filename)
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+
+        if streaming:
+            # lexemes are read lazily, chunk by chunk
+            self.filename = filename
+            self.lexemes = self._stream_lexemes()
+        elif legacy:
+            self._tokenize_legacy(filename)
+        else:
+            self._tokenize(filename)
 
     def __iter__(self):
         return self
@@ -113,6 +339,9 @@ class Lexer:
         return self.next()
 
     def next(self):
+        if self.streaming:
+            return self.process_lexeme(next(self.lexemes))
+
         self.last_lexeme += 1
 
         if self.last_lexeme < len(self.lexemes):
@@ -132,7 +361,166 @@ class Lexer:
 
     def _tokenize(self, filename):
         """
-        Reads in the passed file and breaks apart text into lexemes.
+        Reads in the passed file and breaks apart text into lexemes,
+        matching one whole lexeme per step with the SCANNER regex.
+        """
+        self.filename = filename
+
+        with open(filename) as fin:
+            operand = fin.read()
+
+        self.lexemes = []
+        self.last_lexeme = -1
+
+        # track current line
+        current_line = 1
+
+        for match in SCANNER.finditer(operand):
+            kind = match.lastgroup
+
+            # ignore whitespace and comments, but keep track of current line
+            if kind == "whitespace" or kind == "comment":
+                current_line += match.group().count("\n")
+
+            else:
+                self.lexemes.append((match.group(), current_line))
+
+    @staticmethod
+    def relex(stream, offset, removed, inserted):
+        """
+        Updates a TokenStream in place after replacing removed characters at offset
+        of its source with inserted, and returns it. Only the text between the last
+        token unaffected by the edit and the point where the new tokens line up with
+        the old ones again is scanned, the tokens after that are kept, and their shift
+        is left pending in the stream until the next edit.
+        """
+        source = stream.source
+        edit_end = offset + len(inserted)
+        delta = len(inserted) - removed
+
+        stream.source = source[:offset] + inserted + source[offset + removed:]
+
+        # restart after the last token that was matched without looking at the edited text
+        # (a lexeme match depends on at most CHUNK_MARGIN characters after its end)
+        kept = stream.end_index(offset - CHUNK_MARGIN)
+        # from kept on, the old tokens are stored as offset_delta and line_delta before their place
+        stream.move_shift(kept)
+        if kept:
+            position = stream.ends[kept - 1]
+            current_line = stream.lines[kept - 1]
+        else:
+            position = 0
+            current_line = 1
+
+        terminals = array("i")
+        starts = array("i")
+        ends = array("i")
+        lines = array("i")
+
+        old_starts = stream.starts
+        resync = len(stream)
+        line_delta = 0
+
+        for terminal_id, start, end, line in scan_tokens(stream.source, position, current_line):
+
+            # past the edit, a token starting where an old one did is followed by the same tokens
+            if start >= edit_end:
+                old_start = start - delta - stream.offset_delta
+                old_index = bisect_left(old_starts, old_start, kept)
+                if old_index < len(old_starts) and old_starts[old_index] == old_start:
+                    resync = old_index
+                    line_delta = line - stream.line(old_index)
+                    break
+
+            terminals.append(terminal_id)
+            starts.append(start)
+            ends.append(end)
+            lines.append(line)
+
+        # splice the new tokens in, the tail after them now lies delta more behind
+        stream.terminals[kept:resync] = terminals
+        stream.starts[kept:resync] = starts
+        stream.ends[kept:resync] = ends
+        stream.lines[kept:resync] = lines
+
+        stream.shift_index = kept + len(terminals)
+        stream.offset_delta += delta
+        stream.line_delta += line_delta
+
+        return stream
+
+    def _stream_lexemes(self):
+        """
+        Reads the file chunk by chunk and yields its lexemes lazily,
+        so memory use does not grow with the size of the file.
+        """
+        buffer = ""
+        in_comment = False
+
+        # track current line
+        current_line = 1
+
+        with open(self.filename) as fin:
+            while True:
+                chunk = fin.read(self.chunk_size)
+                at_eof = not chunk
+                buffer += chunk
+
+                # skip the rest of a comment that straddles a chunk boundary
+                if in_comment:
+                    comment_end = buffer.find("*)")
+
+                    if comment_end < 0:
+                        current_line += buffer.count("\n")
+
+                        # a trailing '*' may still be closed by the next chunk
+                        buffer = "*" if buffer.endswith("*") else ""
+
+                        if at_eof:
+                            break
+                        continue
+
+                    current_line += buffer.count("\n", 0, comment_end)
+                    buffer = buffer[comment_end + 2:]
+                    in_comment = False
+
+                limit = len(buffer) - CHUNK_MARGIN
+                carry = ""
+
+                for match in SCANNER.finditer(buffer):
+                    kind = match.lastgroup
+
+                    # ignore whitespace, but keep track of current line
+                    if kind == "whitespace":
+                        current_line += match.group().count("\n")
+
+                    elif kind == "comment":
+                        comment = match.group()
+                        current_line += comment.count("\n")
+
+                        # an unterminated comment continues in the next chunk
+                        if not at_eof and not comment.endswith("*)"):
+                            in_comment = True
+                            carry = "*" if comment.endswith("*") else ""
+                            break
+
+                    # the lexeme may be cut off by the end of the chunk, scan it again with the next one
+                    elif not at_eof and match.end() > limit:
+                        carry = buffer[match.start():]
+                        break
+
+                    else:
+                        yield match.group(), current_line
+
+                buffer = carry
+
+                if at_eof:
+                    break
+
+    def _tokenize_legacy(self, filename):
+        """
+        Reads in the passed file and breaks apart text into lexemes,
+        one character at a time.
         """
         self.filename = filename
 
@@ -243,29 +631,7 @@ class Lexer:
         """
         lexeme, line_number = token
 
-        # recognize keywords and operators
-        if lexeme in KEYWORDS.keys():
-            return Token(lexeme, KEYWORDS[lexeme], line_number)
+        # equal lexemes share one string
+        lexeme = sys.intern(lexeme)
 
-        # recognize identifiers
-        elif re.match(IDENT, lexeme):
-            return Token(lexeme, Terminal.IDENT, line_number)
-
-        # recognize integer literals
-        elif re.match(INTCONST, lexeme):
-            if not (abs(int(lexeme, 10)) >> 31):
-                return Token(lexeme, Terminal.INTCONST, line_number)
-            else:
-                raise MiplInvalidConst(f"**** invalid integer constant: {lexeme}")
-
-        # recognize character literals
-        elif re.match(CHARCONST, lexeme):
-            return Token(lexeme, Terminal.CHARCONST, line_number)
-
-        # raise for invalid characters
-        elif re.match(CHARCONST_INVALID, lexeme):
-            raise MiplInvalidConst(f"**** invalid character constant: {lexeme}")
-
-        # otherwise, return unknown
-        else:
-            return Token(lexeme, Terminal.UNKNOWN, line_number)
+        return Token(lexeme, classify_lexeme(lexeme), line_number)
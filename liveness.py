@@ -0,0 +1,97 @@
+from collections import deque
+from typing import Iterable, Iterator, List, Set, Tuple
+from cfg import ControlFlowGraph
+from tpcc_types.quaternion import *
+
+
+def quaternion_uses(ir: QuaternionIR, index: int) -> Tuple[int, ...]:
+    """
+    The variables and temporaries read by the quaternion at index.
+    """
+    return tuple(operand for operand in (ir.lhs[index], ir.rhs[index]) if is_variable(operand))
+
+
+def program_variables(ir: QuaternionIR) -> Set[int]:
+    """
+    The operands of the program variables read or assigned in ir.
+    """
+    variables = set()
+    for column in (ir.lhs, ir.rhs, ir.results):
+        for operand in column:
+            if operand & OPERAND_MASK == OperandKind.VAR:
+                variables.add(operand)
+    return variables
+
+
+class Liveness:
+    """
+    Backward liveness of variables and temporaries over a ControlFlowGraph, as sets of operands
+    live at the beginning and at the end of every block. The operands in exit_live are live at
+    the end of the program.
+    """
+    graph: ControlFlowGraph
+    live_in: List[Set[int]]
+    live_out: List[Set[int]]
+
+    def __init__(self, graph: ControlFlowGraph, exit_live: Iterable[int] = ()):
+        self.graph = graph
+        ir = graph.ir
+        opcodes, results = ir.opcodes, ir.results
+
+        uses = list()
+        defs = list()
+        for block in graph:
+            block_uses = set()
+            block_defs = set()
+            for index in range(block.start, block.end):
+                for operand in quaternion_uses(ir, index):
+                    if operand not in block_defs:
+                        block_uses.add(operand)
+                if opcodes[index] in ASSIGNING_OPCODES:
+                    block_defs.add(results[index])
+            uses.append(block_uses)
+            defs.append(block_defs)
+
+        self.live_in = [set() for _ in graph.blocks]
+        self.live_out = [set() for _ in graph.blocks]
+        self.live_in[graph.exit.id] = set(exit_live)
+
+        blocks = graph.blocks
+        worklist = deque(reversed(range(len(blocks))))
+        queued = bytearray(b'\x01') * len(blocks)
+        while worklist:
+            block_id = worklist.popleft()
+            queued[block_id] = 0
+            block = blocks[block_id]
+            if block is graph.exit:
+                continue
+            live_out = set()
+            for successor in block.successors:
+                live_out |= self.live_in[successor]
+            self.live_out[block_id] = live_out
+            live_in = uses[block_id] | (live_out - defs[block_id])
+            if live_in != self.live_in[block_id]:
+                self.live_in[block_id] = live_in
+                for predecessor in block.predecessors:
+                    if not queued[predecessor]:
+                        queued[predecessor] = 1
+                        worklist.append(predecessor)
+
+    def backwards(self, block_id: int, keep=None) -> Iterator[Tuple[int, Set[int]]]:
+        """
+        Yields the quaternion indices of a block from the last one, each with the set of operands
+        live right after it (updated in place). A quaternion unflagged in keep by the caller
+        before the next step is treated as removed.
+        """
+        ir = self.graph.ir
+        block = self.graph.blocks[block_id]
+        live = set(self.live_out[block_id])
+        for index in range(block.end - 1, block.start - 1, -1):
+            if keep is not None and not keep[index]:
+                continue
+            yield index, live
+            if keep is not None and not keep[index]:
+                continue
+            if ir.opcodes[index] in ASSIGNING_OPCODES:
+                live.discard(ir.results[index])
+            live.update(quaternion_uses(ir, index))
@@ -0,0 +1,295 @@
+from array import array
+from hashlib import sha1
+from typing import Iterable, Iterator, List, Optional
+from elements import Terminal as VT, Nonterminal as VN, TERMINALS, TERMINAL_ID
+from grammar import Action, PRODUCTIONS, START
+from lexer import Token
+from parser import ParserException
+from tpcc_types.parser import *
+from tpcc_types.names import NameTable
+
+TABLE_MODULE = 'll1_table.py'
+
+# Terminal ids come from elements.TERMINAL_ID, the end of input is one more.
+EOF = len(TERMINALS)
+WIDTH = len(TERMINALS) + 1
+
+ACTIONS = tuple(Action)
+ACTION_ID = {action: action_id for action_id, action in enumerate(ACTIONS)}
+
+
+class GrammarException(Exception):
+    pass
+
+
+def grammar_nonterminals() -> List[VN]:
+    nonterminals = list()
+    for lhs, _ in PRODUCTIONS:
+        if lhs not in nonterminals:
+            nonterminals.append(lhs)
+    return nonterminals
+
+
+def grammar_hash() -> str:
+    """
+    Fingerprint of everything the parse table is computed from.
+    """
+    text = repr([terminal.value for terminal in TERMINALS])
+    text += repr([(lhs.value, [symbol.value for symbol in rhs]) for lhs, rhs in PRODUCTIONS])
+    return sha1(text.encode()).hexdigest()
+
+
+def first_sets(nonterminals: List[VN]):
+    """
+    Computes FIRST(A) and whether A is nullable for every nonterminal A. Actions derive the empty string.
+    """
+    first = {nonterminal: set() for nonterminal in nonterminals}
+    nullable = {nonterminal: False for nonterminal in nonterminals}
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rhs in PRODUCTIONS:
+            rhs_first, rhs_nullable = sequence_first(rhs, first, nullable)
+            if not rhs_first <= first[lhs]:
+                first[lhs] |= rhs_first
+                changed = True
+            if rhs_nullable and not nullable[lhs]:
+                nullable[lhs] = True
+                changed = True
+    return first, nullable
+
+
+def sequence_first(symbols, first, nullable):
+    result = set()
+    for symbol in symbols:
+        if type(symbol) is VT:
+            result.add(symbol)
+            return result, False
+        elif type(symbol) is VN:
+            result |= first[symbol]
+            if not nullable[symbol]:
+                return result, False
+    return result, True
+
+
+def follow_sets(nonterminals: List[VN], first, nullable):
+    follow = {nonterminal: set() for nonterminal in nonterminals}
+    follow[START].add(None)  # the end of input
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rhs in PRODUCTIONS:
+            for i, symbol in enumerate(rhs):
+                if type(symbol) is not VN:
+                    continue
+                rest_first, rest_nullable = sequence_first(rhs[i + 1:], first, nullable)
+                if rest_nullable:
+                    rest_first = rest_first | follow[lhs]
+                if not rest_first <= follow[symbol]:
+                    follow[symbol] |= rest_first
+                    changed = True
+    return follow
+
+
+def build_table():
+    """
+    Computes the dense LL(1) parse table: table[nonterminal id * WIDTH + terminal id] is the
+    production to expand, or -1. A conflict between a production predicted by its FIRST set and
+    an empty one predicted by FOLLOW is resolved for the former (so else binds to the nearest if).
+    """
+    nonterminals = grammar_nonterminals()
+    first, nullable = first_sets(nonterminals)
+    follow = follow_sets(nonterminals, first, nullable)
+
+    table = array('h', [-1]) * (len(nonterminals) * WIDTH)
+    by_follow = set()
+    for production_id, (lhs, rhs) in enumerate(PRODUCTIONS):
+        rhs_first, rhs_nullable = sequence_first(rhs, first, nullable)
+        predicted = [(terminal, False) for terminal in rhs_first]
+        if rhs_nullable:
+            predicted += [(terminal, True) for terminal in follow[lhs] - rhs_first]
+        for terminal, via_follow in predicted:
+            cell = nonterminals.index(lhs) * WIDTH + (EOF if terminal is None else TERMINAL_ID[terminal])
+            if table[cell] >= 0:
+                if via_follow and cell not in by_follow:
+                    continue
+                if via_follow or cell not in by_follow:
+                    raise GrammarException(f'LL(1) conflict on {lhs} and {terminal}: '
+                                           f'productions {table[cell]} and {production_id}')
+            table[cell] = production_id
+            if via_follow:
+                by_follow.add(cell)
+            else:
+                by_follow.discard(cell)
+
+    # Right-hand sides are stored reversed, ready to be pushed on the parse stack:
+    # terminals as their ids, nonterminals as WIDTH + their ids, actions as ~their ids.
+    productions = list()
+    for lhs, rhs in PRODUCTIONS:
+        encoded = list()
+        for symbol in reversed(rhs):
+            if type(symbol) is VT:
+                encoded.append(TERMINAL_ID[symbol])
+            elif type(symbol) is VN:
+                encoded.append(WIDTH + nonterminals.index(symbol))
+            else:
+                encoded.append(~ACTION_ID[symbol])
+        productions.append(tuple(encoded))
+
+    return WIDTH + nonterminals.index(START), table, tuple(productions)
+
+
+def write_table(filename: str = TABLE_MODULE):
+    start, table, productions = build_table()
+    with open(filename, 'w') as fout:
+        print('# Generated by ll1.py from grammar.py, do not edit.', file=fout)
+        print('from array import array', file=fout)
+        print(file=fout)
+        print(f'GRAMMAR_HASH = {grammar_hash()!r}', file=fout)
+        print(f'START = {start}', file=fout)
+        print('TABLE = array(\'h\', [', file=fout)
+        for row in range(0, len(table), WIDTH):
+            print('    ' + ', '.join(str(cell) for cell in table[row:row + WIDTH]) + ',', file=fout)
+        print('])', file=fout)
+        print('PRODUCTIONS = (', file=fout)
+        for production in productions:
+            print(f'    {production!r},', file=fout)
+        print(')', file=fout)
+
+
+def load_table():
+    """
+    Returns the parse table generated at build time, or computes it if it is missing or stale.
+    """
+    try:
+        import ll1_table
+    except ImportError:
+        return build_table()
+    if ll1_table.GRAMMAR_HASH != grammar_hash():
+        return build_table()
+    return ll1_table.START, ll1_table.TABLE, ll1_table.PRODUCTIONS
+
+
+class LL1Parser:
+    """
+    Table-driven LL(1) parser for the grammar in grammar.py, producing the same nodes as Parser.
+    """
+    tokens_iter: Iterator[Token]
+    last_token: Token
+    values: List
+    nodes: List
+    declarations: List[VariableDeclarationNode]
+    names: NameTable
+
+    def __init__(self, tokens: Iterable[Token], names: Optional[NameTable] = None):
+        self.tokens_iter = iter(tokens)
+        self.names = names if names is not None else NameTable()
+        self.values = list()
+        self.nodes = list()
+        self.declarations = list()
+        self.start, self.table, self.productions = load_table()
+        self.actions = [getattr(self, 'action_' + action.name.lower()) for action in ACTIONS]
+
+    def parse(self):
+        self.nodes.extend(self.parse_iter())
+        return self.nodes
+
+    def parse_iter(self) -> Iterator[StatementNode]:
+        """
+        Yields top-level statements one by one, as soon as each of them is parsed.
+        """
+        table = self.table
+        productions = self.productions
+        actions = self.actions
+        tokens_iter = self.tokens_iter
+        stack = [EOF, self.start]
+
+        token = next(tokens_iter, None)
+        terminal_id = EOF if token is None else TERMINAL_ID[token.terminal]
+        while stack:
+            symbol = stack.pop()
+            if symbol >= WIDTH:
+                production = table[(symbol - WIDTH) * WIDTH + terminal_id]
+                if production < 0:
+                    raise ParserException(f'Unexpected token: {token}', token)
+                stack.extend(productions[production])
+            elif symbol >= 0:
+                if symbol != terminal_id:
+                    expected = 'end of input' if symbol == EOF else TERMINALS[symbol]
+                    raise ParserException(f'Unexpected token value, expected {expected}, '
+                                          f'received {token and token.terminal}', token)
+                self.last_token = token
+                token = next(tokens_iter, None)
+                terminal_id = EOF if token is None else TERMINAL_ID[token.terminal]
+            else:
+                node = actions[~symbol]()
+                if node is not None:
+                    yield node
+
+    def action_program(self):
+        return ProgramNode(self.last_token.lexeme)
+
+    def action_discard(self):
+        self.values.pop()
+
+    def action_emit(self):
+        return self.values.pop()
+
+    def action_names(self):
+        self.values.append([self.names.identifier(self.last_token.lexeme)])
+
+    def action_name(self):
+        self.values[-1].append(self.names.identifier(self.last_token.lexeme))
+
+    def action_declaration(self):
+        node = VariableDeclarationNode(self.values.pop(), VariableType.Integer)
+        self.declarations.append(node)
+        self.values.append(node)
+
+    def action_list(self):
+        self.values.append(list())
+
+    def action_append(self):
+        statement = self.values.pop()
+        self.values[-1].append(statement)
+
+    def action_assign(self):
+        value = self.values.pop()
+        self.values.append(VariableAssignmentNode(self.values.pop(), value))
+
+    def action_if(self):
+        false_statements = self.values.pop()
+        true_statements = self.values.pop()
+        self.values.append(IfStatementNode(self.values.pop(), true_statements, false_statements))
+
+    def action_while(self):
+        statements = self.values.pop()
+        self.values.append(WhileStatementNode(self.values.pop(), statements))
+
+    def action_repeat(self):
+        condition = self.values.pop()
+        self.values.append(RepeatStatementNode(condition, self.values.pop()))
+
+    def action_read(self):
+        self.values.append(ReadStatementNode(self.values.pop()))
+
+    def action_write(self):
+        self.values.append(PrintStatementNode(self.values.pop()))
+
+    def action_identifier(self):
+        self.values.append(self.names.identifier(self.last_token.lexeme))
+
+    def action_number(self):
+        self.values.append(self.names.number(int(self.last_token.lexeme)))
+
+    def action_operator(self):
+        self.values.append(self.last_token.terminal)
+
+    def action_binary(self):
+        rhs = self.values.pop()
+        operator = self.values.pop()
+        self.values.append(BinaryExpressionNode(self.values.pop(), rhs, operator))
+
+
+if __name__ == '__main__':
+    write_table()
@@ -1,8 +1,16 @@
 from argparse import ArgumentParser
+import csv
 import sys
-from lexer import Lexer
+from lexer import Lexer, TokenStream
 from parser import Parser
+from ll1 import LL1Parser
 from quaternizer import Quaternizer
+from optimizer import LEVELS, PASSES, PassManager
+from vm import Program, VirtualMachine
+from pybackend import compile_program
+from batch import BatchMachine, declared_names
+from cbackend import CTranslator, compile_native
+from tpcc_types.names import NameTable
 
 
 arg_parser = ArgumentParser(description='tpcc - Tiny PasCal Compiler')
@@ -10,29 +18,129 @@ arg_parser.add_argument('-o', '--output', required=False, help='Output file')
 arg_parser.add_argument('-l', '--lexer', action='store_true', required=False, help='Run lexer only')
 arg_parser.add_argument('-p', '--parser', action='store_true', required=False, help='Run lexer and parser only(override -l --lexer)')
 arg_parser.add_argument('-q', '--quaternizer', action='store_true', required=False, help='Run lexer, parser, and quaternizer(default)')
+arg_parser.add_argument('--legacy-lexer', action='store_true', required=False, help='Use the character-by-character lexer')
+arg_parser.add_argument('--ll1', action='store_true', required=False, help='Parse with the table-driven LL(1) parser')
+arg_parser.add_argument('-s', '--stream', action='store_true', required=False, help='Compile input files statement by statement, printing results as soon as they are ready')
+arg_parser.add_argument('-f', '--fall-through', action='store_true', required=False, help='Lay conditions out with negated jumps falling through, one per comparison')
+arg_parser.add_argument('-O', '--optimize', type=int, default=0, choices=sorted(LEVELS), required=False, help='Optimization level of quaternions, like -O1 (default: 0)')
+arg_parser.add_argument('--passes', required=False, help=f'Comma separated optimization passes to run instead of the -O level ones, from: {",".join(PASSES)}')
+arg_parser.add_argument('--stats', action='store_true', required=False, help='Print the time taken by each optimization pass, and the quaternions and temporaries left')
+arg_parser.add_argument('--verify', action='store_true', required=False, help='Check the quaternions after each optimization pass')
+arg_parser.add_argument('--run', action='store_true', required=False, help='Execute the quaternions, printing the final values of the variables and the instructions per second')
+arg_parser.add_argument('--backend', default='vm', choices=['vm', 'python', 'c'], required=False, help='How --run executes the quaternions: by the virtual machine, compiled to a Python function, or to C by the system compiler (default: vm)')
+arg_parser.add_argument('--emit-c', action='store_true', required=False, help='Print the quaternions translated to C instead')
+arg_parser.add_argument('--batch', metavar='CSV', required=False, help='Execute the quaternions once per row of a CSV file of initial values headed by variable names, printing a CSV of the final values (needs numpy)')
 arg_parser.add_argument('input_files', nargs='+', help='Input file(s)')
 args = arg_parser.parse_args()
+if args.stream and (args.optimize or args.passes):
+    arg_parser.error('-O and --passes need the whole program, they cannot be combined with -s')
+if args.stream and (args.run or args.batch or args.emit_c):
+    arg_parser.error('--run, --batch and --emit-c need the whole program, they cannot be combined with -s')
+if args.lexer or args.parser:
+    quaternion_options = {
+        '-O': args.optimize, '--passes': args.passes is not None, '--stats': args.stats, '--verify': args.verify,
+        '--run': args.run, '--backend': args.backend != 'vm', '--emit-c': args.emit_c, '--batch': args.batch,
+    }
+    used = [option for option, value in quaternion_options.items() if value]
+    if used:
+        arg_parser.error(f'{", ".join(used)} cannot be combined with -l or -p, which stop before quaternions')
+outputs = [option for option, value in (('--run', args.run), ('--batch', args.batch), ('--emit-c', args.emit_c)) if value]
+if len(outputs) > 1:
+    arg_parser.error(f'{" and ".join(outputs)} cannot be combined, choose one output')
+if args.backend != 'vm' and not args.run:
+    arg_parser.error('--backend only applies to --run')
+if args.passes is not None:
+    passes = [name for name in args.passes.split(',') if name]
+    unknown = [name for name in passes if name not in PASSES]
+    if unknown:
+        arg_parser.error(f'unknown passes: {", ".join(unknown)}')
+else:
+    passes = LEVELS[args.optimize]
 
 if args.input_files is None:
     print('Fatal: no input files', file=sys.stderr)
     exit(1)
 
+
+def read_tokens(input_file: str):
+    if args.stream:
+        return Lexer(input_file, streaming=True).get_tokens()
+    if args.legacy_lexer:
+        return list(Lexer(input_file, legacy=True).get_tokens())
+    return TokenStream.from_file(input_file)
+
+
+def make_parser(tokens, names: NameTable):
+    if args.ll1:
+        return LL1Parser(tokens, names)
+    return Parser(tokens, names)
+
+
 for input_file in args.input_files:
+    names = NameTable()
     run_lexer = args.lexer
     run_parser = args.parser
     run_quaternizer = args.quaternizer
     if run_lexer:
-        tokens = list(Lexer(input_file).get_tokens())
+        tokens = read_tokens(input_file)
         results = tokens
     elif run_parser:
-        tokens = list(Lexer(input_file).get_tokens())
-        nodes = Parser(tokens).parse()
+        tokens = read_tokens(input_file)
+        nodes = make_parser(tokens, names).parse_iter() if args.stream else make_parser(tokens, names).parse()
         results = nodes
-    else:
-        tokens = list(Lexer(input_file).get_tokens())
-        nodes = Parser(tokens).parse()
-        quaternions = Quaternizer(nodes).generate()
+    elif args.stream:
+        tokens = read_tokens(input_file)
+        nodes = make_parser(tokens, names).parse_iter()
+        quaternions = Quaternizer(nodes, names, args.fall_through).generate_iter()
         results = quaternions
+    else:
+        tokens = read_tokens(input_file)
+        program_parser = make_parser(tokens, names)
+        nodes = program_parser.parse()
+        quaternions = Quaternizer(nodes, names, args.fall_through).generate()
+        pass_manager = PassManager(passes, args.verify)
+        results = pass_manager.run(quaternions)
+        if args.stats:
+            for record in pass_manager.records:
+                print(f'{input_file}: {record}', file=sys.stderr)
+        if args.emit_c:
+            output_file = open(args.output, 'w+') if args.output is not None else sys.stdout
+            declared = declared_names(program_parser.declarations)
+            print(CTranslator(results, declared).translate(), end='', file=output_file)
+            continue
+        if args.batch is not None:
+            machine = BatchMachine(Program(results), declared_names(program_parser.declarations))
+            with open(args.batch, newline='') as batch_file:
+                header, *rows = csv.reader(batch_file)
+            table = {name: [int(row[column]) for row in rows] for column, name in enumerate(header)}
+            columns = machine.run(table, len(rows))
+            print(f'{input_file}: {machine.report()}', file=sys.stderr)
+            failed = machine.failed.nonzero()[0]
+            if len(failed):
+                print(f'{input_file}: rows {", ".join(str(row + 1) for row in failed)} stopped on division by zero',
+                      file=sys.stderr)
+            output_file = open(args.output, 'w+', newline='') if args.output is not None else sys.stdout
+            writer = csv.writer(output_file)
+            writer.writerow(machine.columns)
+            for row in range(len(rows)):
+                # the rows stopped on division by zero have no final values
+                writer.writerow('' if machine.failed[row] else columns[name][row] for name in machine.columns)
+            continue
+        if args.run:
+            # the declared variables are reported even when optimizations removed them
+            declared = declared_names(program_parser.declarations)
+            if args.backend == 'python':
+                machine = compile_program(results, declared)
+            elif args.backend == 'c':
+                machine = compile_native(results, declared)
+            else:
+                machine = VirtualMachine(Program(results, declared))
+            variables = machine.run()
+            print(f'{input_file}: {machine.report()}', file=sys.stderr)
+            output_file = open(args.output, 'w+') if args.output is not None else sys.stdout
+            for name, value in variables.items():
+                print(f'{name} = {value}', file=output_file)
+            continue
     if args.output is not None:
         output_file = open(args.output, 'w+')
         i = 0
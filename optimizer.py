@@ -0,0 +1,640 @@
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from tpcc_types.quaternion import *
+from cfg import ControlFlowGraph, block_starts, compact, jump_dest, has_preheader_room, insert_preheaders
+from liveness import Liveness, program_variables
+from ssa import propagate_constants
+
+
+CONST = OperandKind.CONST
+TEMP = OperandKind.TEMP
+
+
+def fold_constants(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Folds arithmetic on constants and propagates the constants assigned to variables and
+    temporaries, within basic blocks. Conditional jumps on constants become unconditional
+    jumps or are removed, and so are the temporaries no longer read.
+    Division by zero is left to run time.
+    """
+    count = len(ir)
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    starts = block_starts(ir)
+    keep = bytearray(b'\x01') * count
+    known: Dict[int, int] = dict()  # constant values of variables and temporaries in this block
+
+    for index in range(count):
+        if starts[index]:
+            known.clear()
+        opcode = opcodes[index]
+        a = lhs[index]
+        if a in known:
+            a = lhs[index] = const_operand(known[a])
+        b = rhs[index]
+        if b in known:
+            b = rhs[index] = const_operand(known[b])
+        a_const = a & OPERAND_MASK == CONST
+        b_const = b & OPERAND_MASK == CONST
+
+        if opcode == Opcode.ASSIGN:
+            if a_const:
+                known[results[index]] = a >> OPERAND_SHIFT
+            else:
+                known.pop(results[index], None)
+        elif opcode in EVALUATE:
+            if a_const and b_const and not (opcode == Opcode.DIV and b >> OPERAND_SHIFT == 0):
+                value = EVALUATE[opcode](a >> OPERAND_SHIFT, b >> OPERAND_SHIFT)
+                opcodes[index] = Opcode.ASSIGN
+                lhs[index] = const_operand(value)
+                rhs[index] = NO_OPERAND
+                known[results[index]] = value
+            else:
+                known.pop(results[index], None)
+        elif opcode in COMPARE and a_const and b_const:
+            if COMPARE[opcode](a >> OPERAND_SHIFT, b >> OPERAND_SHIFT):
+                opcodes[index] = Opcode.JUMP
+                lhs[index] = rhs[index] = NO_OPERAND
+            else:
+                keep[index] = 0
+
+    # constant temporaries are not needed anymore once propagated to all their reads
+    read = set()
+    for index in range(count):
+        if keep[index]:
+            read.add(lhs[index])
+            read.add(rhs[index])
+    for index in range(count):
+        if opcodes[index] == Opcode.ASSIGN and results[index] & OPERAND_MASK == TEMP and results[index] not in read:
+            keep[index] = 0
+
+    return compact(ir, keep)
+
+
+COMMUTATIVE_OPCODES = frozenset((Opcode.ADD, Opcode.MUL))
+
+
+def number_values(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Local value numbering: a calculation already done in the same basic block, with the same
+    operator and operands (in any order for + and *), is removed and its result replaced by
+    the earlier one, as long as none of the operands, nor the earlier result, was assigned since.
+    Reads are only replaced up to the next assignment of either, in the same block, and the
+    calculations whose result is still read somewhere are put back.
+    """
+    count = len(ir)
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    starts = block_starts(ir)
+    keep = bytearray(b'\x01') * count
+    values: Dict[Tuple[int, int, int], int] = dict()  # (opcode, lhs, rhs) -> operand holding its value
+    uses: Dict[int, list] = dict()  # operand -> the keys of values depending on it
+    replaced: Dict[int, int] = dict()  # removed temporary -> the operand it is replaced with
+    holding: Dict[int, list] = dict()  # operand -> the removed temporaries replaced with it
+    removed: Dict[int, int] = dict()  # removed temporary -> the index of its calculation
+    pending: List[int] = list()  # removed calculations whose result may be read without replacement
+
+    for index in range(count):
+        if starts[index]:
+            values.clear()
+            uses.clear()
+            pending.extend(removed.values())
+            replaced.clear()
+            holding.clear()
+            removed.clear()
+        opcode = opcodes[index]
+        a = lhs[index]
+        if a in replaced:
+            a = lhs[index] = replaced[a]
+        b = rhs[index]
+        if b in replaced:
+            b = rhs[index] = replaced[b]
+        if opcode in JUMP_OPCODES:
+            continue
+
+        result = results[index]
+        if opcode in EVALUATE:
+            key = (opcode, b, a) if opcode in COMMUTATIVE_OPCODES and b < a else (opcode, a, b)
+            holder = values.get(key)
+            if holder == result:
+                # computed again into the same operand, which already holds the value
+                keep[index] = 0
+                continue
+        else:
+            key = holder = None
+
+        # the result is assigned: forget the values and the replacements depending on it
+        for stale in uses.pop(result, ()):
+            values.pop(stale, None)
+        if replaced.pop(result, None) is not None:
+            # every read of the removed result was replaced
+            del removed[result]
+        elif result in removed:
+            pending.append(removed.pop(result))
+        for temporary in holding.pop(result, ()):
+            if replaced.get(temporary) == result:
+                del replaced[temporary]
+        if holder is not None and result & OPERAND_MASK == TEMP:
+            replaced[result] = holder
+            holding.setdefault(holder, []).append(result)
+            removed[result] = index
+            keep[index] = 0
+            continue
+        if key is not None and result != a and result != b:
+            values[key] = result
+            for operand in (a, b, result):
+                uses.setdefault(operand, []).append(key)
+
+    pending.extend(removed.values())
+    # put back the calculations of the temporaries still read, by reads left alone or put back
+    read = set()
+    for index in range(count):
+        if keep[index]:
+            read.add(lhs[index])
+            read.add(rhs[index])
+    changed = True
+    while changed:
+        changed = False
+        for index in pending:
+            if not keep[index] and results[index] in read:
+                keep[index] = 1
+                read.add(lhs[index])
+                read.add(rhs[index])
+                changed = True
+
+    return compact(ir, keep)
+
+
+def drop_jumps_to_next(ir: QuaternionIR, keep):
+    """
+    Unflags in keep the jumps to the next quaternion kept, which fall through anyway.
+    """
+    opcodes = ir.opcodes
+    count = len(ir)
+    next_kept = count  # the first index kept after the current one
+    # backwards, so that removing a jump can make the ones before it jump to the next quaternion too
+    first_kept_from = array('q', bytes(8 * (count + 1)))
+    first_kept_from[count] = count
+    for index in range(count - 1, -1, -1):
+        if keep[index] and opcodes[index] in JUMP_OPCODES:
+            dest = jump_dest(ir, index)
+            if index < dest <= count and first_kept_from[dest] == next_kept:
+                keep[index] = 0
+        if keep[index]:
+            next_kept = index
+        first_kept_from[index] = next_kept
+
+
+def thread_jumps(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Makes jumps to unconditional jumps go to their final destination, and turns a conditional
+    jump over an unconditional one into the negated conditional jump. Then removes the jumps
+    to the next quaternion.
+    """
+    count = len(ir)
+    opcodes, results = ir.opcodes, ir.results
+    for index in range(count):
+        if opcodes[index] not in JUMP_OPCODES:
+            continue
+        dest = jump_dest(ir, index)
+        seen = {index}
+        while 0 <= dest < count and opcodes[dest] == Opcode.JUMP and dest not in seen:
+            seen.add(dest)
+            dest = jump_dest(ir, dest)
+        results[index] = label_operand(ir.base + dest + 1)
+
+    targets = bytearray(count + 1)
+    for index in range(count):
+        if opcodes[index] in JUMP_OPCODES:
+            targets[min(max(jump_dest(ir, index), 0), count)] = 1
+    keep = bytearray(b'\x01') * count
+    for index in range(count - 1):
+        if (opcodes[index] in NEGATED and opcodes[index + 1] == Opcode.JUMP and not targets[index + 1]
+                and jump_dest(ir, index) == index + 2):
+            opcodes[index] = NEGATED[opcodes[index]]
+            results[index] = results[index + 1]
+            keep[index + 1] = 0
+    drop_jumps_to_next(ir, keep)
+    return compact(ir, keep)
+
+
+def remove_unreachable(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Removes the basic blocks not reachable from the entry, and then the jumps to the next quaternion.
+    """
+    graph = ControlFlowGraph(ir)
+    reachable = graph.reachable()
+    keep = bytearray(len(ir))
+    for block in graph:
+        if reachable[block.id]:
+            keep[block.start:block.end] = b'\x01' * len(block)
+    drop_jumps_to_next(ir, keep)
+    return compact(ir, keep)
+
+
+def eliminate_dead_stores(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Removes the assignments and calculations whose result is not read before it is assigned again,
+    or before the end of the program for temporaries. Program variables are live at the end.
+    A division is kept unless its divisor is a nonzero constant, since it may fail at run time.
+    The blocks not reachable from the entry are removed too: liveness does not flow through them,
+    so the assignments they read may be removed.
+    """
+    exit_live = program_variables(ir)
+    while True:
+        graph = ControlFlowGraph(ir)
+        liveness = Liveness(graph, exit_live)
+        reachable = graph.reachable()
+        opcodes, rhs, results = ir.opcodes, ir.rhs, ir.results
+        keep = bytearray(b'\x01') * len(ir)
+        removed = 0
+        for block in graph:
+            if not reachable[block.id]:
+                keep[block.start:block.end] = bytes(len(block))
+                removed += len(block)
+                continue
+            for index, live in liveness.backwards(block.id, keep):
+                opcode = opcodes[index]
+                if opcode not in ASSIGNING_OPCODES or results[index] in live:
+                    continue
+                if opcode == Opcode.DIV and (rhs[index] & OPERAND_MASK != CONST or rhs[index] == const_operand(0)):
+                    continue
+                keep[index] = 0
+                removed += 1
+        if not removed:
+            return ir
+        ir = compact(ir, keep)
+
+
+def compact_temporaries(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Renames temporaries so that each one takes the lowest numbered name not used by
+    the temporaries live at the same time, in program order.
+    """
+    graph = ControlFlowGraph(ir)
+    liveness = Liveness(graph)
+    opcodes, results = ir.opcodes, ir.results
+    interferes: Dict[int, Set[int]] = dict()
+    for block in graph:
+        for index, live in liveness.backwards(block.id):
+            result = results[index]
+            if opcodes[index] in ASSIGNING_OPCODES and result & OPERAND_MASK == TEMP:
+                neighbours = interferes.setdefault(result, set())
+                for operand in live:
+                    if operand & OPERAND_MASK == TEMP and operand != result:
+                        neighbours.add(operand)
+                        interferes.setdefault(operand, set()).add(result)
+
+    renamed: Dict[int, int] = dict()
+    for index in range(len(ir)):
+        result = results[index]
+        if result in interferes and result not in renamed:
+            taken = {renamed[neighbour] for neighbour in interferes[result] if neighbour in renamed}
+            number = 1
+            while temp_operand(number) in taken:
+                number += 1
+            renamed[result] = temp_operand(number)
+    for column in (ir.lhs, ir.rhs, ir.results):
+        for index in range(len(column)):
+            if column[index] in renamed:
+                column[index] = renamed[column[index]]
+    return ir
+
+
+def hoist_invariants(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Loop-invariant code motion. A calculation into a temporary whose operands are constants, variables
+    not assigned in the loop, or temporaries already hoisted, is moved to a preheader inserted before
+    the loop header. Jumps entering the loop go to the preheader, back edges still go to the header.
+    Outer loops are handled first, so code is moved as far out as possible.
+    A division is only hoisted if its divisor is a nonzero constant, or if its block dominates every
+    exit of the loop, so that it runs anyway once the loop is entered.
+    """
+    graph = ControlFlowGraph(ir)
+    idom = graph.dominators()
+    loops = sorted(graph.loops(idom), key=lambda loop: len(loop.blocks), reverse=True)
+    if not loops:
+        return ir
+    liveness = Liveness(graph, program_variables(ir))
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    blocks = graph.blocks
+    keep = bytearray(b'\x01') * len(ir)
+    preheaders = list()
+    hoisted_temps = set()
+
+    for loop in loops:
+        if not has_preheader_room(graph, loop):
+            continue
+
+        assigned: Dict[int, int] = dict()  # number of assignments in the loop, by operand
+        exits = list()
+        live_after_loop = set()
+        for block_id in loop.blocks:
+            block = blocks[block_id]
+            for index in range(block.start, block.end):
+                if opcodes[index] in ASSIGNING_OPCODES:
+                    assigned[results[index]] = assigned.get(results[index], 0) + 1
+            for successor in block.successors:
+                if successor not in loop.blocks:
+                    exits.append(block_id)
+                    live_after_loop |= liveness.live_in[successor]
+
+        hoisted = list()
+        changed = True
+        while changed:
+            changed = False
+            for block_id in sorted(loop.blocks):
+                block = blocks[block_id]
+                for index in range(block.start, block.end):
+                    opcode = opcodes[index]
+                    result = results[index]
+                    if not keep[index] or opcode not in ASSIGNING_OPCODES or result & OPERAND_MASK != TEMP:
+                        continue
+                    if assigned[result] != 1 or result in liveness.live_in[loop.header] or result in live_after_loop:
+                        continue
+                    if any(operand in assigned and operand not in hoisted_temps
+                           for operand in (lhs[index], rhs[index]) if is_variable(operand)):
+                        continue
+                    if opcode == Opcode.DIV and (rhs[index] & OPERAND_MASK != CONST or rhs[index] == const_operand(0)) \
+                            and not (exits and all(graph.dominates(idom, block_id, exit) for exit in exits)):
+                        continue
+                    keep[index] = 0
+                    hoisted.append((opcode, lhs[index], rhs[index], result))
+                    hoisted_temps.add(result)
+                    changed = True
+
+        if hoisted:
+            preheaders.append((loop, hoisted))
+
+    if not preheaders:
+        return ir
+    return insert_preheaders(graph, keep, preheaders)
+
+
+def induction_step(ir: QuaternionIR, starts: bytearray, index: int) -> Optional[int]:
+    """
+    The constant k if the quaternion at index is an update i := i + k or i := i - k of its result i,
+    either directly or through a temporary calculated by the quaternion before, otherwise None.
+    """
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    variable = results[index]
+    if opcodes[index] == Opcode.ASSIGN and lhs[index] & OPERAND_MASK == TEMP and index > 0 and not starts[index] \
+            and results[index - 1] == lhs[index]:
+        index -= 1
+    opcode = opcodes[index]
+    if opcode == Opcode.ADD and rhs[index] == variable and lhs[index] & OPERAND_MASK == CONST:
+        return operand_value(lhs[index])
+    if opcode in (Opcode.ADD, Opcode.SUB) and lhs[index] == variable and rhs[index] & OPERAND_MASK == CONST:
+        step = operand_value(rhs[index])
+        return step if opcode == Opcode.ADD else -step
+    return None
+
+
+def reduce_induction_variables(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Strength reduction of loop induction variables. A basic induction variable i of a loop is only
+    assigned in it by updates i := i + k or i := i - k, with constants k. A product of i by a nonzero
+    constant c, into a temporary read only in the same block before i changes, is replaced with a new
+    temporary set to i * c in a preheader, and increased by k * c right after every update of i.
+    Outer loops are handled first, so products are reduced in the outermost loop they can be.
+    """
+    graph = ControlFlowGraph(ir)
+    idom = graph.dominators()
+    loops = sorted(graph.loops(idom), key=lambda loop: len(loop.blocks), reverse=True)
+    if not loops:
+        return ir
+    liveness = Liveness(graph, program_variables(ir))
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    blocks = graph.blocks
+    starts = block_starts(ir)
+
+    reads: Dict[int, int] = dict()
+    assignments: Dict[int, int] = dict()
+    next_temp = 1
+    for index in range(len(ir)):
+        for operand in (lhs[index], rhs[index]):
+            reads[operand] = reads.get(operand, 0) + 1
+        if opcodes[index] in ASSIGNING_OPCODES:
+            assignments[results[index]] = assignments.get(results[index], 0) + 1
+            if results[index] & OPERAND_MASK == TEMP:
+                next_temp = max(next_temp, operand_value(results[index]) + 1)
+
+    keep = bytearray(b'\x01') * len(ir)
+    preheaders = list()
+    appended: Dict[int, list] = dict()
+    renamed: Dict[int, int] = dict()
+    for loop in loops:
+        if not has_preheader_room(graph, loop):
+            continue
+        updates: Dict[int, list] = dict()  # basic induction variable -> [(index of update, k)]
+        not_basic = set()
+        live_after_loop = set()
+        for block_id in loop.blocks:
+            block = blocks[block_id]
+            for index in range(block.start, block.end):
+                if opcodes[index] in ASSIGNING_OPCODES:
+                    step = induction_step(ir, starts, index)
+                    if step is None:
+                        not_basic.add(results[index])
+                    else:
+                        updates.setdefault(results[index], []).append((index, step))
+            for successor in block.successors:
+                if successor not in loop.blocks:
+                    live_after_loop |= liveness.live_in[successor]
+        for variable in not_basic:
+            updates.pop(variable, None)
+
+        preheader = list()
+        reduced: Dict[Tuple[int, int], int] = dict()  # (i, c) -> the temporary holding i * c
+        for block_id in sorted(loop.blocks):
+            block = blocks[block_id]
+            for index in range(block.start, block.end):
+                product = results[index]
+                if not keep[index] or opcodes[index] != Opcode.MUL or product & OPERAND_MASK != TEMP:
+                    continue
+                if lhs[index] in updates and rhs[index] & OPERAND_MASK == CONST:
+                    variable, factor = lhs[index], operand_value(rhs[index])
+                elif rhs[index] in updates and lhs[index] & OPERAND_MASK == CONST:
+                    variable, factor = rhs[index], operand_value(lhs[index])
+                else:
+                    continue
+                if factor == 0 or assignments[product] != 1 or product in liveness.live_in[loop.header] \
+                        or product in live_after_loop:
+                    continue
+                # all the reads of the product must come before the next update of i
+                read_before_update = 0
+                for later in range(index + 1, block.end):
+                    if opcodes[later] in ASSIGNING_OPCODES and results[later] == variable:
+                        break
+                    read_before_update += (lhs[later] == product) + (rhs[later] == product)
+                if read_before_update != reads.get(product, 0):
+                    continue
+
+                if (variable, factor) not in reduced:
+                    reduced[(variable, factor)] = temp = temp_operand(next_temp)
+                    next_temp += 1
+                    preheader.append((Opcode.MUL, variable, const_operand(factor), temp))
+                    for update, step in updates[variable]:
+                        increment = const_operand(wrap_int(step * factor))
+                        appended.setdefault(update, []).append((Opcode.ADD, temp, increment, temp))
+                keep[index] = 0
+                renamed[product] = reduced[(variable, factor)]
+        if preheader:
+            preheaders.append((loop, preheader))
+
+    if not preheaders:
+        return ir
+    for column in (lhs, rhs):
+        for index in range(len(column)):
+            if column[index] in renamed:
+                column[index] = renamed[column[index]]
+    return insert_preheaders(graph, keep, preheaders, appended)
+
+
+def reduce_strength(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Replaces multiplications and divisions by constants with cheaper quaternions: x * 0 with 0,
+    x * 1 and x / 1 with x, x * 2 with x + x and x * 2^n with a left shift by n, which wraps around
+    the same way. Divisions by other powers of two are kept, as they round toward zero where
+    a right shift rounds down.
+    """
+    opcodes, lhs, rhs = ir.opcodes, ir.lhs, ir.rhs
+    for index in range(len(ir)):
+        opcode = opcodes[index]
+        if opcode == Opcode.MUL:
+            if rhs[index] & OPERAND_MASK == CONST:
+                operand, factor = lhs[index], operand_value(rhs[index])
+            elif lhs[index] & OPERAND_MASK == CONST:
+                operand, factor = rhs[index], operand_value(lhs[index])
+            else:
+                continue
+            if factor == 0:
+                opcodes[index], lhs[index], rhs[index] = Opcode.ASSIGN, const_operand(0), NO_OPERAND
+            elif factor == 1:
+                opcodes[index], lhs[index], rhs[index] = Opcode.ASSIGN, operand, NO_OPERAND
+            elif factor == 2:
+                opcodes[index], lhs[index], rhs[index] = Opcode.ADD, operand, operand
+            elif factor > 0 and factor & (factor - 1) == 0:
+                shift = factor.bit_length() - 1
+                opcodes[index], lhs[index], rhs[index] = Opcode.SHL, operand, const_operand(shift)
+        elif opcode == Opcode.DIV and rhs[index] == const_operand(1):
+            opcodes[index], rhs[index] = Opcode.ASSIGN, NO_OPERAND
+    return ir
+
+
+# Optimization passes by name, and the passes run at each -O level.
+PASSES: Dict[str, Callable[[QuaternionIR], QuaternionIR]] = {
+    'fold': fold_constants,
+    'sccp': propagate_constants,
+    'lvn': number_values,
+    'thread': thread_jumps,
+    'unreachable': remove_unreachable,
+    'licm': hoist_invariants,
+    'iv': reduce_induction_variables,
+    'strength': reduce_strength,
+    'dse': eliminate_dead_stores,
+    'temps': compact_temporaries,
+}
+
+LEVELS: Dict[int, Tuple[str, ...]] = {
+    0: (),
+    1: ('fold', 'lvn', 'thread', 'unreachable', 'strength', 'dse', 'temps'),
+    2: ('fold', 'sccp', 'lvn', 'thread', 'unreachable', 'licm', 'iv', 'strength', 'dse', 'temps'),
+}
+
+
+class OptimizerException(Exception):
+    pass
+
+
+def verify_ir(ir: QuaternionIR):
+    """
+    Checks the invariants passes rely on, and raises OptimizerException if one does not hold:
+    operands are of the kinds their opcode expects, jump destinations are in range,
+    and every temporary read is assigned somewhere.
+    """
+    count = len(ir)
+    assigned = set()
+    read = dict()
+    for index in range(count):
+        opcode, a, b, result = ir.opcodes[index], ir.lhs[index], ir.rhs[index], ir.results[index]
+        pos = ir.base + index + 1
+        if opcode not in OPCODE_SYMBOLS:
+            raise OptimizerException(f'({pos}): unknown opcode {opcode}')
+        if opcode in JUMP_OPCODES:
+            if operand_kind(result) != OperandKind.LABEL:
+                raise OptimizerException(f'({pos}) {ir.format(index)}: jump without a destination')
+            if not ir.base < operand_value(result) <= ir.base + count + 1:
+                raise OptimizerException(f'({pos}) {ir.format(index)}: destination out of range')
+            expected = (opcode != Opcode.JUMP, opcode != Opcode.JUMP)
+        else:
+            if not is_variable(result):
+                raise OptimizerException(f'({pos}) {ir.format(index)}: result is not a variable')
+            assigned.add(result)
+            expected = (True, opcode != Opcode.ASSIGN)
+        for operand, needed in zip((a, b), expected):
+            kind = operand_kind(operand)
+            if needed != (kind != OperandKind.NONE) or kind == OperandKind.LABEL:
+                raise OptimizerException(f'({pos}) {ir.format(index)}: unexpected operand')
+            if kind == OperandKind.VAR and operand_value(operand) >= len(ir.names):
+                raise OptimizerException(f'({pos}) {ir.format(index)}: unknown variable')
+            if kind == OperandKind.TEMP:
+                read.setdefault(operand, pos)
+    for temp, pos in read.items():
+        if temp not in assigned:
+            raise OptimizerException(f'({pos}): {ir.format_operand(temp)} is read but never assigned')
+
+
+def count_temporaries(ir: QuaternionIR) -> int:
+    return len({operand for column in (ir.lhs, ir.rhs, ir.results) for operand in column
+                if operand & OPERAND_MASK == TEMP})
+
+
+class PassRecord:
+    __slots__ = ('name', 'seconds', 'quaternions', 'temporaries')
+
+    def __init__(self, name: str, seconds: float, quaternions: int, temporaries: int):
+        self.name = name
+        self.seconds = seconds
+        self.quaternions = quaternions
+        self.temporaries = temporaries
+
+    def __str__(self):
+        return f'{self.name}: {self.seconds * 1000:.3f} ms, {self.quaternions} quaternions, ' \
+               f'{self.temporaries} temporaries'
+
+
+class PassManager:
+    """
+    Runs quaternion passes in order. After each one, it records its wall time and the number of
+    quaternions and temporaries left, and, if verify is set, checks the IR with verify_ir().
+    """
+    passes: List[str]
+    records: List[PassRecord]
+
+    def __init__(self, passes: Iterable[str], verify: bool = False):
+        self.passes = list(passes)
+        for name in self.passes:
+            if name not in PASSES:
+                raise OptimizerException(f'Unknown pass: {name}, known passes: {", ".join(PASSES)}')
+        self.verify = verify
+        self.records = list()
+
+    @classmethod
+    def from_level(cls, level: int, verify: bool = False) -> 'PassManager':
+        return cls(LEVELS[level], verify)
+
+    def run(self, ir: QuaternionIR) -> QuaternionIR:
+        self.records.append(PassRecord('(input)', 0.0, len(ir), count_temporaries(ir)))
+        if self.verify:
+            verify_ir(ir)
+        for name in self.passes:
+            start = time.perf_counter()
+            ir = PASSES[name](ir)
+            seconds = time.perf_counter() - start
+            self.records.append(PassRecord(name, seconds, len(ir), count_temporaries(ir)))
+            if self.verify:
+                try:
+                    verify_ir(ir)
+                except OptimizerException as exception:
+                    raise OptimizerException(f'After pass {name}: {exception}') from exception
+        return ir
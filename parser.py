@@ -1,7 +1,19 @@
-from typing import Iterator, List, Optional
+from typing import Iterable, Iterator, List, Optional
 from elements import Terminal as VT, Nonterminal as VN, Operator, Parens
-from lexer import Token, Terminal
+from lexer import Token, Terminal, TokenStream
 from tpcc_types.parser import *
+from tpcc_types.names import NameTable
+
+
+# Binary operators, with their precedence and whether they are right associative.
+BINARY_OPERATORS = {
+    Terminal.OR: (1, False),
+    Terminal.AND: (2, False),
+    Terminal.PLUS: (3, False), Terminal.MINUS: (3, False),
+    Terminal.MULT: (4, False), Terminal.DIV: (4, False),
+    Terminal.EQ: (5, False), Terminal.NE: (5, False), Terminal.LT: (5, False),
+    Terminal.GT: (5, False), Terminal.LE: (5, False), Terminal.GE: (5, False),
+}
 
 
 class ParserException(Exception):
@@ -14,18 +26,82 @@ class ParserException(Exception):
         return self.message + '\nCurrent token: ' + str(self.token)
 
 
+class ParseCache:
+    """
+    The top-level statements of the last parse of a TokenStream, kept to be reused by the next
+    parse after an edit. A statement is reused if the tokens it spans, and the token following it,
+    hash the same as before. Its start is looked up at the same token index first, then shifted
+    by the number of tokens inserted or removed by the edit.
+    Nodes are reused as they are, so a cache must always be used with the same NameTable.
+    """
+    entries: dict[int, tuple[int, int, StatementNode]]
+    token_count: int
+    names: NameTable
+
+    def __init__(self, names: Optional[NameTable] = None):
+        self.names = names if names is not None else NameTable()
+        self.entries = dict()
+        self.token_count = 0
+        self.new_entries = dict()
+        self.reused = 0
+        self.parsed = 0
+
+    @staticmethod
+    def span_hash(stream: TokenStream, start: int, end: int) -> int:
+        last = min(end, len(stream) - 1)  # the token after a statement decides where it ends
+        return hash((stream.terminals[start:last + 1].tobytes(),
+                     stream.source[stream.start(start):stream.end(last)]))
+
+    def lookup(self, stream: TokenStream, start: int):
+        """
+        Returns the (end, span hash, node) entry of a cached statement starting at token start, or None.
+        """
+        delta = len(stream) - self.token_count
+        for old_start in (start, start - delta) if delta else (start,):
+            entry = self.entries.get(old_start)
+            if entry is None:
+                continue
+            end = entry[0] - old_start + start
+            if end <= len(stream) and self.span_hash(stream, start, end) == entry[1]:
+                return end, entry[1], entry[2]
+        return None
+
+    def store(self, start: int, entry: tuple[int, int, StatementNode]):
+        self.new_entries[start] = entry
+
+    def update(self, stream: TokenStream):
+        """
+        Replaces the entries with the ones stored by the parse of stream that just ended.
+        """
+        self.entries = self.new_entries
+        self.new_entries = dict()
+        self.token_count = len(stream)
+
+
 class Parser:
     tokens_iter: Iterator[Token]
     current_token: Token
     next_token: Token
     nodes: List
+    declarations: List[VariableDeclarationNode]
     symbol_table: dict[str, VT]
+    names: NameTable
+    cache: Optional[ParseCache]
 
-    def __init__(self, tokens: list[Token]):
+    def __init__(self, tokens: Iterable[Token], names: Optional[NameTable] = None,
+                 cache: Optional[ParseCache] = None):
+        if cache is not None:
+            # the cache needs token indices to find statements, and their nodes to share names
+            assert isinstance(tokens, TokenStream)
+            names = cache.names
+        self.tokens = tokens
+        self.cache = cache
         self.tokens_iter = iter(tokens)
+        self.names = names if names is not None else NameTable()
         self.current_token = next(self.tokens_iter)
         self.next_token = next(self.tokens_iter)
         self.nodes = list()
+        self.declarations = list()
         self.symbol_table = dict()
 
     def eat_token(self, token: Optional[Enum] = None):
@@ -35,6 +111,14 @@ class Parser:
         self.current_token = self.next_token
         self.next_token = next(self.tokens_iter)
 
+    def seek(self, index: int):
+        """
+        Moves to the token at index of the TokenStream being parsed.
+        """
+        self.tokens_iter = self.tokens.iter_from(index)
+        self.current_token = next(self.tokens_iter)
+        self.next_token = next(self.tokens_iter)
+
     def is_operator(self, value: Terminal) -> bool:
         return value in Operator
 
@@ -53,12 +137,14 @@ class Parser:
     def parse_primary(self):
         token = self.current_token
         if token.terminal is VT.IDENT:
-            return IdentifierNode(token.lexeme)
+            return self.names.identifier(token.lexeme)
         elif token.terminal is VT.INTCONST:
-            return NumberLiteralNode(int(token.lexeme))
+            return self.names.number(int(token.lexeme))
         else:
             raise ParserException(f'Unexpected token type in expression', self.current_token)
 
+    # The original recursive precedence climbing parser, kept as a reference for benchmark.py.
+    # It loops forever on operators of equal precedence, like a + b + c.
     def _parse_expression(self, lhs: ExpressionBaseNode, min_precedence: int):
         def precedence_of(op: Operator):
             precedences = {Terminal.PLUS: 3, Terminal.MINUS: 3, Terminal.MULT: 4, Terminal.DIV: 4,
@@ -86,7 +172,32 @@ class Parser:
         return lhs
 
     def parse_expression(self):
-        return self._parse_expression(self.parse_primary(), 0)
+        """
+        Parses an expression with an explicit operator stack (shunting-yard), without
+        recursing per operator. Like the rest of the parser, it stops with the last
+        token of the expression as the current token.
+        """
+        operands = [self.parse_primary()]
+        operators = []
+        operator = self.next_token.terminal
+        while operator in BINARY_OPERATORS:
+            precedence, right_associative = BINARY_OPERATORS[operator]
+            # reduce the operators on the stack that bind tighter than this one
+            while operators:
+                top_precedence = BINARY_OPERATORS[operators[-1]][0]
+                if top_precedence < precedence or (top_precedence == precedence and right_associative):
+                    break
+                rhs = operands.pop()
+                operands[-1] = BinaryExpressionNode(operands[-1], rhs, operators.pop())
+            operators.append(operator)
+            self.eat_token()
+            self.eat_token()
+            operands.append(self.parse_primary())
+            operator = self.next_token.terminal
+        while operators:
+            rhs = operands.pop()
+            operands[-1] = BinaryExpressionNode(operands[-1], rhs, operators.pop())
+        return operands[0]
 
     def parse_output(self):
         self.eat_token(VT.WRITE)
@@ -95,7 +206,7 @@ class Parser:
 
     def parse_input(self):
         self.eat_token(VT.READ)
-        node = ReadStatementNode(IdentifierNode(self.current_token.lexeme))
+        node = ReadStatementNode(self.names.identifier(self.current_token.lexeme))
         self.eat_token()
         return node
 
@@ -103,7 +214,7 @@ class Parser:
         name = self.current_token.lexeme
         self.eat_token()
         self.eat_token(VT.ASSIGN)
-        node = VariableAssignmentNode(IdentifierNode(name), self.parse_expression())
+        node = VariableAssignmentNode(self.names.identifier(name), self.parse_expression())
         self.eat_token()  # parse_expression() may not eat the last token of an expression
         self.eat_token(VT.SCOLON)
         return node
@@ -112,11 +223,11 @@ class Parser:
         self.eat_token(VT.VAR)
         # TODO: validate variable name
         names: List[IdentifierNode] = list()
-        names.append(IdentifierNode(self.current_token.lexeme))
+        names.append(self.names.identifier(self.current_token.lexeme))
         self.eat_token(VT.IDENT)
         while self.current_token.terminal == VT.COMMA:
             self.eat_token(VT.COMMA)
-            names.append(IdentifierNode(self.next_token.lexeme))
+            names.append(self.names.identifier(self.current_token.lexeme))
             self.eat_token(VT.IDENT)
         self.eat_token(VT.COLON)
         variable_type_str = self.current_token.lexeme
@@ -211,6 +322,24 @@ class Parser:
         node = RepeatStatementNode(condition, statements)
         return node
 
+    def parse_cached_statement(self):
+        """
+        Parses a top-level statement, or reuses the one the cache has for the same tokens.
+        """
+        cache = self.cache
+        start = self.current_token.index
+        entry = cache.lookup(self.tokens, start)
+        if entry is not None:
+            self.seek(entry[0])
+            cache.reused += 1
+        else:
+            result = self.parse_statement()
+            end = self.current_token.index
+            entry = (end, cache.span_hash(self.tokens, start, end), result)
+            cache.parsed += 1
+        cache.store(start, entry)
+        return entry[2]
+
     def parse_program(self):
         self.eat_token(VT.PROG)
         program = self.current_token.lexeme
@@ -220,18 +349,29 @@ class Parser:
         return node
 
     def _parse(self):
-        self.nodes.append(self.parse_program())
-        self.parse_variable_declaration()
+        self.nodes.extend(self.parse_iter())
+
+    def parse(self):
+        self._parse()
+        return self.nodes
+
+    def parse_iter(self) -> Iterator[StatementNode]:
+        """
+        Yields top-level statements one by one, as soon as each of them is parsed.
+        """
+        yield self.parse_program()
+        self.declarations.append(self.parse_variable_declaration())
         self.eat_token(VT.PROC)
         self.eat_token(VT.IDENT)
         self.eat_token(VT.SCOLON)
         self.eat_token(VT.BEGIN)
-        while self.next_token and self.current_token.terminal != VT.END:
-            self.nodes.append(self.parse_statement())
+        if self.cache is None:
+            while self.next_token and self.current_token.terminal != VT.END:
+                yield self.parse_statement()
+        else:
+            while self.next_token and self.current_token.terminal != VT.END:
+                yield self.parse_cached_statement()
+            self.cache.update(self.tokens)
         # End of the whole program. Stop here, otherwise eat_token() will raise StopIteration.
         # self.eat_token(VT.END)
         # self.eat_token(VT.SCOLON)
-
-    def parse(self):
-        self._parse()
-        return self.nodes
@@ -0,0 +1,485 @@
+import time
+from hashlib import sha1
+from typing import Dict, List, Optional, Sequence, Tuple
+from tpcc_types.quaternion import *
+from cfg import ControlFlowGraph, jump_dest
+from vm import VMException
+
+PYTHON_OPERATORS = {
+    Opcode.ADD: '+', Opcode.SUB: '-', Opcode.MUL: '*', Opcode.SHL: '<<',
+    Opcode.JEQ: '==', Opcode.JNE: '!=', Opcode.JGT: '>', Opcode.JLT: '<', Opcode.JGE: '>=', Opcode.JLE: '<=',
+}
+
+# Translated code is a tree of statements before being written out as Python:
+# strings are plain statements, and the tuples below follow the structured control flow of WebAssembly,
+# as produced by the algorithm of Ramsey ("Beyond Relooper", 2022).
+IF = 'if'  # (IF, (opcode, lhs, rhs), statements when true, statements when false)
+LOOP = 'loop'  # (LOOP, header, statements): branching to it starts it again, falling off its end leaves it
+BLOCK = 'block'  # (BLOCK, follow, statements): branching to it leaves it, to the code of follow right after it
+BRANCH = 'br'  # (BRANCH, (LOOP or BLOCK, block id))
+RETURN = 'return'  # (RETURN,)
+
+
+def program_hash(ir: QuaternionIR, declared: Sequence[str] = ()) -> str:
+    """
+    Fingerprint of everything the translation of ir depends on.
+    """
+    digest = sha1()
+    for column in (ir.opcodes, ir.lhs, ir.rhs, ir.results):
+        digest.update(column.tobytes())
+    digest.update(repr((ir.base, variable_names(ir, declared))).encode())
+    return digest.hexdigest()
+
+
+def variable_names(ir: QuaternionIR, declared: Sequence[str] = ()) -> List[str]:
+    """
+    The declared variables, and then the other program variables of ir in the order of their first appearance.
+    """
+    names = dict.fromkeys(declared)
+    for index in range(len(ir)):
+        for operand in (ir.lhs[index], ir.rhs[index], ir.results[index]):
+            if operand_kind(operand) == OperandKind.VAR:
+                names.setdefault(ir.format_operand(operand), None)
+    return list(names)
+
+
+class PythonTranslator:
+    """
+    Translates an IR to the source of a Python function: basic blocks become straight-line code, natural
+    loops become while loops, and variables and temporaries become locals. Variables are passed as
+    arguments and returned as a tuple, in the order of variable_names(). Irreducible control flow,
+    which no quaternizer output has, falls back to dispatching on the block to run next.
+    """
+    ir: QuaternionIR
+    graph: ControlFlowGraph
+    lines: List[str]
+
+    def __init__(self, ir: QuaternionIR, declared: Sequence[str] = (), function_name: str = 'program'):
+        self.ir = ir
+        self.function_name = function_name
+        self.graph = graph = ControlFlowGraph(ir)
+        self.idom = graph.dominators()
+        self.order = graph.reverse_postorder()
+        self.rpo = [-1] * len(graph.blocks)
+        for position, block_id in enumerate(self.order):
+            self.rpo[block_id] = position
+        self.variables = variable_names(ir, declared)
+        self.lines = list()
+        self.exit_codes: Dict[tuple, int] = dict()  # labels left through several loops at once
+
+    def operand(self, operand: int) -> str:
+        kind = operand_kind(operand)
+        if kind == OperandKind.VAR:
+            return 'v_' + self.ir.format_operand(operand)
+        elif kind == OperandKind.TEMP:
+            return f't{operand_value(operand)}'
+        return str(operand_value(operand))
+
+    def value(self, operand: int, pending: dict) -> Tuple[str, bool, frozenset]:
+        """
+        The text of an operand, whether it still needs wrapping around, and the operands it reads.
+        """
+        if operand in pending:
+            return pending.pop(operand)
+        if is_variable(operand):
+            return self.operand(operand), False, frozenset((operand,))
+        return self.operand(operand), False, frozenset()
+
+    @staticmethod
+    def wrapped(text: str, raw: bool) -> str:
+        return f'(({text} + {-INT_MIN} & {(1 << INT_BITS) - 1}) - {-INT_MIN})' if raw else text
+
+    def store(self, operand: int, text: str, raw: bool) -> List[str]:
+        name = self.operand(operand)
+        if not raw:
+            return [f'{name} = {text}']
+        # wraps around on 32 bits, rarely needed
+        return [f'{name} = {text}',
+                f'if not {INT_MIN} <= {name} <= {INT_MAX}: {name} = ({name} + {-INT_MIN} & {(1 << INT_BITS) - 1}) - {-INT_MIN}']
+
+    def straight_line(self, block) -> Tuple[List[str], Optional[Tuple[int, str, str]]]:
+        """
+        The statements of a block, and the opcode and operands of its conditional jump, if any.
+        Temporaries read once, right in the block, are folded into the expression reading them.
+        Additions, subtractions and multiplications wrap around only once stored or compared, which
+        gives the same result on 32 bits.
+        """
+        ir = self.ir
+        lines = list()
+        pending = dict()  # temporary -> (text, raw, operands read)
+        for index in range(block.start, block.end):
+            opcode = ir.opcodes[index]
+            if opcode == Opcode.JUMP:
+                break
+            lhs = self.value(ir.lhs[index], pending)
+            rhs = self.value(ir.rhs[index], pending) if opcode != Opcode.ASSIGN else ('', False, frozenset())
+            if opcode in CONDITIONAL_JUMP_OPCODES:
+                return lines, (opcode, self.wrapped(lhs[0], lhs[1]), self.wrapped(rhs[0], rhs[1]))
+            reads = lhs[2] | rhs[2]
+            if opcode == Opcode.ASSIGN:
+                text, raw = lhs[0], lhs[1]
+            elif opcode == Opcode.DIV:
+                text, raw = f'divide({self.wrapped(*lhs[:2])}, {self.wrapped(*rhs[:2])})', False
+            elif opcode == Opcode.SHL:
+                text, raw = f'({lhs[0]} << {self.wrapped(*rhs[:2])})', True
+            else:
+                text, raw = f'({lhs[0]} {PYTHON_OPERATORS[opcode]} {rhs[0]})', True
+            result = ir.results[index]
+            # the expressions reading the operand assigned are computed before
+            for temporary in [temporary for temporary, entry in pending.items() if result in entry[2]]:
+                lines.extend(self.store(temporary, *pending.pop(temporary)[:2]))
+            if result in self.folded:
+                pending[result] = (text, raw, reads)
+            else:
+                lines.extend(self.store(result, text, raw))
+        for temporary, (text, raw, _) in pending.items():
+            lines.extend(self.store(temporary, text, raw))
+        return lines, None
+
+    def fold_temporaries(self):
+        """
+        Finds the temporaries assigned once and read once, later in the same block.
+        """
+        ir, block_of = self.ir, self.graph.block_of
+        assigned = dict()
+        read = dict()
+        for index in range(len(ir)):
+            for operand in (ir.lhs[index], ir.rhs[index]):
+                if operand_kind(operand) == OperandKind.TEMP:
+                    read[operand] = index if operand not in read else -1
+            if ir.opcodes[index] in ASSIGNING_OPCODES and operand_kind(ir.results[index]) == OperandKind.TEMP:
+                operand = ir.results[index]
+                assigned[operand] = index if operand not in assigned else -1
+        self.folded = {operand for operand, index in assigned.items()
+                       if index >= 0 and read.get(operand, -1) > index and block_of[read[operand]] == block_of[index]}
+
+    def translate(self) -> str:
+        ir = self.ir
+        self.fold_temporaries()
+        temporaries = sorted({operand for column in (ir.lhs, ir.rhs, ir.results) for operand in column
+                              if operand_kind(operand) == OperandKind.TEMP} - self.folded)
+        arguments = ', '.join('v_' + name for name in self.variables)
+        self.lines.append(f'def {self.function_name}({arguments}):')
+        for temporary in temporaries:
+            self.lines.append(f'    {self.operand(temporary)} = 0')
+        if self.reducible():
+            self.place()
+            body = self.tree(0)
+            start = len(self.lines)
+            self.write(body, 1, [])
+            if self.exit_codes:
+                self.lines.insert(start, '    _exit = 0')
+        else:
+            self.write_dispatch()
+        if len(self.lines) == 1:
+            self.lines.append('    pass')
+        return '\n'.join(self.lines) + '\n'
+
+    def returned(self) -> str:
+        return 'return (' + ''.join(f'v_{name}, ' for name in self.variables) + ')'
+
+    def reducible(self) -> bool:
+        """
+        Whether every retreating edge goes to a block dominating its source.
+        """
+        for block_id in self.order:
+            for successor in self.graph.blocks[block_id].successors:
+                if self.rpo[successor] <= self.rpo[block_id] \
+                        and not self.graph.dominates(self.idom, successor, block_id):
+                    return False
+        return True
+
+    def place(self):
+        """
+        Decides where the code of every block goes. A block entered by a single forward edge goes right
+        where that edge is taken, unless it leaves a loop. The others go after a BLOCK wrapped around the
+        code of their immediate dominator, or around the loop they leave.
+        """
+        graph, idom, rpo = self.graph, self.idom, self.rpo
+        self.loops = {loop.header: loop for loop in graph.loops(self.idom)}
+        self.merge = bytearray(len(graph.blocks))
+        for block_id in self.order:
+            forward = sum(1 for predecessor in graph.blocks[block_id].predecessors
+                          if rpo[predecessor] != -1 and rpo[predecessor] < rpo[block_id])
+            self.merge[block_id] = forward >= 2
+        self.inline = [list() for _ in graph.blocks]
+        self.outside = [list() for _ in graph.blocks]  # placed after the loop headed by the block
+        self.inside = [list() for _ in graph.blocks]  # placed within the loop, if any
+        for block_id in self.order[1:]:
+            parent = idom[block_id]
+            headers = [header for header, loop in self.loops.items()
+                       if parent in loop.blocks and block_id not in loop.blocks]
+            if headers:
+                # after the outermost loop it leaves
+                header = max(headers, key=lambda header: len(self.loops[header].blocks))
+                self.outside[header].append(block_id)
+            elif self.merge[block_id]:
+                self.inside[parent].append(block_id)
+            else:
+                self.inline[parent].append(block_id)
+        for follows in self.outside + self.inside:
+            follows.sort(key=lambda block_id: rpo[block_id], reverse=True)
+
+    def tree(self, block_id: int) -> list:
+        """
+        The code of block_id, and of the blocks placed with it.
+        """
+        code = list()
+        while True:
+            # the code of the outermost follow comes after everything else, at the same level
+            if self.outside[block_id]:
+                follow = self.outside[block_id][0]
+                code.append((BLOCK, follow, self.within(block_id, self.outside[block_id][1:], self.inside[block_id])))
+            elif self.inside[block_id] and block_id not in self.loops:
+                follow = self.inside[block_id][0]
+                code.append((BLOCK, follow, self.within(block_id, [], self.inside[block_id][1:])))
+            else:
+                code.extend(self.within(block_id, [], self.inside[block_id]))
+                return code
+            block_id = follow
+
+    def within(self, block_id: int, outside: list, inside: list) -> list:
+        if outside:
+            return [(BLOCK, outside[0], self.within(block_id, outside[1:], inside))] + self.tree(outside[0])
+        if block_id in self.loops:
+            return [(LOOP, block_id, self.within_loop(block_id, inside))]
+        return self.within_loop(block_id, inside)
+
+    def within_loop(self, block_id: int, inside: list) -> list:
+        if inside:
+            return [(BLOCK, inside[0], self.within_loop(block_id, inside[1:]))] + self.tree(inside[0])
+        return self.body(block_id)
+
+    def body(self, block_id: int) -> list:
+        ir, graph = self.ir, self.graph
+        block = graph.blocks[block_id]
+        if block is graph.exit:
+            return [(RETURN,)]
+        code, condition = self.straight_line(block)
+        last = block.end - 1
+        fall = graph.block_of[block.end]
+        if ir.opcodes[last] not in JUMP_OPCODES:
+            return code + self.branch(block_id, fall)
+        dest = graph.block_of[min(max(jump_dest(ir, last), 0), len(ir))]
+        if ir.opcodes[last] == Opcode.JUMP:
+            return code + self.branch(block_id, dest)
+        if dest == fall:
+            return code + self.branch(block_id, fall)
+        code.append((IF, condition, self.branch(block_id, dest), self.branch(block_id, fall)))
+        return code
+
+    def branch(self, source: int, target: int) -> list:
+        if self.rpo[target] <= self.rpo[source]:
+            return [(BRANCH, (LOOP, target))]
+        if target in self.inline[source]:
+            return self.tree(target)
+        return [(BRANCH, (BLOCK, target))]
+
+    def write(self, code: list, depth: int, frames: List[list]):
+        """
+        Writes code out at an indentation depth, within Python loops standing for the labels in frames,
+        innermost last, as [continue label, break label, labels left through it].
+        """
+        indent = '    ' * depth
+        for statement in code:
+            if type(statement) is str:
+                self.lines.append(indent + statement)
+            elif statement[0] == IF:
+                _, (opcode, lhs, rhs), when_true, when_false = statement
+                if not when_true:
+                    if not when_false:
+                        continue
+                    opcode, when_true, when_false = NEGATED[opcode], when_false, when_true
+                self.lines.append(f'{indent}if {lhs} {PYTHON_OPERATORS[opcode]} {rhs}:')
+                self.write_suite(when_true, depth + 1, frames)
+                if when_false:
+                    self.lines.append(f'{indent}else:')
+                    self.write_suite(when_false, depth + 1, frames)
+            elif statement[0] == RETURN:
+                self.lines.append(indent + self.returned())
+            elif statement[0] == BRANCH:
+                self.write_branch(statement[1], indent, frames)
+            else:
+                self.write_construct(statement, depth, frames)
+
+    def write_suite(self, code: list, depth: int, frames: List[list]):
+        # blocks left with nothing to do still need a statement
+        count = len(self.lines)
+        self.write(code, depth, frames)
+        if len(self.lines) == count:
+            self.lines.append('    ' * depth + 'pass')
+
+    def write_construct(self, statement: tuple, depth: int, frames: List[list]):
+        kind, block_id, body = statement
+        label = (kind, block_id)
+        continue_label = break_label = None
+        if kind == BLOCK:
+            body = without_tail_branch(body, label)
+            if not branches_to(body, label):
+                self.write(body, depth, frames)
+                return
+            break_label = label
+            if len(body) == 1 and type(body[0]) is tuple and body[0][0] == LOOP:
+                # a loop alone in a block: breaking the loop leaves the block too
+                continue_label = (LOOP, body[0][1])
+                body = body[0][2]
+        else:
+            continue_label = label
+        indent = '    ' * depth
+        frame = [continue_label, break_label, set()]
+        self.lines.append(f'{indent}while True:')
+        self.write(body, depth + 1, frames + [frame])
+        if falls_through(body):
+            self.lines.append(f'{indent}    break')
+        # branches to labels outside the loop just left
+        parent = frames[-1] if frames else None
+        passed = False
+        for label in sorted(frame[2]):
+            if parent is not None and label in parent[:2]:
+                self.lines.append(f'{indent}if _exit == {self.exit_codes[label]}:')
+                self.lines.append(f'{indent}    _exit = 0')
+                self.lines.append(f'{indent}    {"continue" if label == parent[0] else "break"}')
+            else:
+                parent[2].add(label)
+                passed = True
+        if passed:
+            self.lines.append(f'{indent}if _exit:')
+            self.lines.append(f'{indent}    break')
+
+    def write_branch(self, label: tuple, indent: str, frames: List[list]):
+        for depth in range(len(frames) - 1, -1, -1):
+            frame = frames[depth]
+            if label in frame[:2]:
+                break
+        else:
+            raise VMException(f'Branch to {label} out of any enclosing construct')
+        if depth == len(frames) - 1:
+            self.lines.append(indent + ('continue' if label == frame[0] else 'break'))
+            return
+        code = self.exit_codes.setdefault(label, len(self.exit_codes) + 1)
+        self.lines.append(f'{indent}_exit = {code}')
+        self.lines.append(f'{indent}break')
+        frames[-1][2].add(label)
+
+    def write_dispatch(self):
+        ir, graph = self.ir, self.graph
+        self.lines.append('    _block = 0')
+        self.lines.append('    while True:')
+        for position, block_id in enumerate(self.order):
+            block = graph.blocks[block_id]
+            self.lines.append(f'        {"if" if position == 0 else "elif"} _block == {block_id}:')
+            if block is graph.exit:
+                self.lines.append(f'            {self.returned()}')
+                continue
+            lines, condition = self.straight_line(block)
+            self.lines.extend(f'            {line}' for line in lines)
+            last = block.end - 1
+            fall = graph.block_of[block.end]
+            if ir.opcodes[last] in JUMP_OPCODES:
+                dest = graph.block_of[min(max(jump_dest(ir, last), 0), len(ir))]
+                if ir.opcodes[last] == Opcode.JUMP:
+                    fall = dest
+                else:
+                    opcode, lhs, rhs = condition
+                    self.lines.append(f'            if {lhs} {PYTHON_OPERATORS[opcode]} {rhs}:')
+                    self.lines.append(f'                _block = {dest}')
+                    self.lines.append('                continue')
+            self.lines.append(f'            _block = {fall}')
+
+
+def without_tail_branch(code: list, label: tuple) -> list:
+    """
+    Drops the branches to label ending code, where falling off its end goes to the same place.
+    """
+    if not code:
+        return code
+    last = code[-1]
+    if type(last) is not tuple:
+        return code
+    if last[0] == BRANCH and last[1] == label:
+        return code[:-1]
+    if last[0] == IF:
+        return code[:-1] + [(IF, last[1], without_tail_branch(last[2], label), without_tail_branch(last[3], label))]
+    if last[0] == BLOCK:
+        return code[:-1] + [(BLOCK, last[1], without_tail_branch(last[2], label))]
+    return code
+
+
+def branches_to(code: list, label: tuple) -> bool:
+    for statement in code:
+        if type(statement) is not tuple:
+            continue
+        if statement[0] == BRANCH:
+            if statement[1] == label:
+                return True
+        elif statement[0] == IF:
+            if branches_to(statement[2], label) or branches_to(statement[3], label):
+                return True
+        elif statement[0] != RETURN and branches_to(statement[2], label):
+            return True
+    return False
+
+
+def falls_through(code: list) -> bool:
+    """
+    Whether running code can reach its end, with the meaning of LOOP and BLOCK.
+    """
+    if not code:
+        return True
+    last = code[-1]
+    if type(last) is not tuple:
+        return True
+    if last[0] == BRANCH or last[0] == RETURN:
+        return False
+    if last[0] == IF:
+        return falls_through(last[2]) or falls_through(last[3])
+    if last[0] == LOOP:
+        return falls_through(last[2])
+    return falls_through(last[2]) or branches_to(last[2], (BLOCK, last[1]))
+
+
+class CompiledProgram:
+    """
+    An IR translated to a Python function, compiled once.
+    """
+    source: str
+    variables: List[str]
+    seconds: float
+
+    def __init__(self, ir: QuaternionIR, declared: Sequence[str] = ()):
+        translator = PythonTranslator(ir, declared)
+        self.source = translator.translate()
+        self.variables = translator.variables
+        namespace = {'divide': divide}
+        exec(compile(self.source, f'<tpcc {program_hash(ir, declared)[:12]}>', 'exec'), namespace)
+        self.function = namespace[translator.function_name]
+        self.seconds = 0.0
+
+    def run(self, variables: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        variables = variables or dict()
+        arguments = [wrap_int(variables.get(name, 0)) for name in self.variables]
+        start = time.perf_counter()
+        try:
+            values = self.function(*arguments)
+        except ZeroDivisionError:
+            raise VMException('Division by zero') from None
+        finally:
+            self.seconds = time.perf_counter() - start
+        return dict(zip(self.variables, values))
+
+    def report(self) -> str:
+        return f'ran in {self.seconds * 1000:.3f} ms'
+
+
+COMPILED: Dict[str, CompiledProgram] = dict()
+
+
+def compile_program(ir: QuaternionIR, declared: Sequence[str] = ()) -> CompiledProgram:
+    """
+    The CompiledProgram of ir, compiled only the first time the same program is seen.
+    """
+    key = program_hash(ir, declared)
+    program = COMPILED.get(key)
+    if program is None:
+        program = COMPILED[key] = CompiledProgram(ir, declared)
+    return program
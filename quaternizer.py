@@ -1,7 +1,15 @@
-from typing import Iterator, List, Optional
+from typing import Iterable, Iterator, List, Optional
 from elements import Terminal as VT
 from tpcc_types.parser import *
 from tpcc_types.quaternion import *
+from tpcc_types.names import NameTable
+from jumplist import JumpList, merge
+
+
+ARITHMETIC_OPERATORS = {VT.PLUS: Opcode.ADD, VT.MINUS: Opcode.SUB, VT.MULT: Opcode.MUL, VT.DIV: Opcode.DIV}
+
+RELATIONAL_OPERATORS = {VT.EQ: Opcode.JEQ, VT.NE: Opcode.JNE, VT.GT: Opcode.JGT, VT.LT: Opcode.JLT,
+                        VT.GE: Opcode.JGE, VT.LE: Opcode.JLE}
 
 
 class QuaternizerException(Exception):
@@ -16,18 +24,36 @@ class QuaternizerException(Exception):
 
 class Quaternizer:
     nodes: Iterator[StatementNode]
-    quaternions: List[Quaternion]
+    quaternions: QuaternionIR  # since the last flush of generate_iter()
     current_pos: int  # The position of next quaternion to be generated, started from 1.
     current_node: StatementNode
     temporary_variables: int
-    temporary_labels: int
+    names: NameTable  # the parser's name table, if any
 
-    def __init__(self, nodes: List[StatementNode]):
+    def __init__(self, nodes: Iterable[StatementNode], names: Optional[NameTable] = None, fall_through: bool = False):
         self.nodes = iter(nodes)
-        self.quaternions = list()
+        self.fall_through = fall_through  # lay conditions out with one exit falling through
+        self.shared_names = names is not None  # then name ids of the nodes can be used as they are
+        self.names = names if names is not None else NameTable()
+        self.quaternions = QuaternionIR(self.names)
         self.current_pos = 0
         self.temporary_variables = 0
-        self.temporary_labels = 0
+        # dispatch tables, by node type
+        self.statement_handlers = {
+            ProgramNode: self.parse_program,
+            VariableAssignmentNode: self.parse_variable_assignment,
+            IfStatementNode: self.parse_if_statement,
+            WhileStatementNode: self.parse_while_statement,
+            RepeatStatementNode: self.parse_repeat_statement,
+        }
+        if fall_through:
+            self.statement_handlers[IfStatementNode] = self.parse_if_fall_through
+            self.statement_handlers[WhileStatementNode] = self.parse_while_fall_through
+            self.statement_handlers[RepeatStatementNode] = self.parse_repeat_fall_through
+        self.leaf_operands = {
+            NumberLiteralNode: lambda node: const_operand(node.value),
+            IdentifierNode: self.identifier_operand,
+        }
 
     def next_node(self) -> Optional[StatementNode]:
         try:
@@ -36,146 +62,147 @@ class Quaternizer:
             return None
         return self.current_node
 
-    def emit(self, quaternion: Quaternion) -> int:
-        self.quaternions.append(quaternion)
-        self.current_pos = len(self.quaternions)
+    def emit(self, opcode: Opcode, lhs: int = NO_OPERAND, rhs: int = NO_OPERAND, result: int = NO_OPERAND) -> int:
+        self.current_pos = self.quaternions.append(opcode, lhs, rhs, result)
         return self.current_pos
 
-    def get_temporary_variable(self) -> str:
-        self.temporary_variables += 1
-        return f't{self.temporary_variables}'
+    def emit_jump(self, opcode: Opcode, lhs: int = NO_OPERAND, rhs: int = NO_OPERAND) -> JumpList:
+        """
+        Emits a jump whose destination is not known yet.
+        """
+        return JumpList(self.emit(opcode, lhs, rhs))
 
-    def get_temporary_label(self) -> str:
-        self.temporary_labels += 1
-        return f'l{self.temporary_labels}'
+    def identifier_operand(self, node: IdentifierNode) -> int:
+        if self.shared_names and node.name_id >= 0:
+            return var_operand(node.name_id)
+        return var_operand(self.names.intern(node.value))
+
+    def get_temporary_variable(self) -> int:
+        self.temporary_variables += 1
+        return temp_operand(self.temporary_variables)
 
     def generate(self):
         self._generate()
         return self.quaternions
 
+    def generate_iter(self) -> Iterator[Quaternion]:
+        """
+        Yields quaternions as soon as the top-level statement they belong to is translated
+        and all of its jumps are backpatched, without keeping them afterwards.
+        """
+        node = self.next_node()
+        while node is not None:
+            self.backpatch(self.parse_node(node), self.current_pos + 1)
+            completed = self.quaternions
+            self.quaternions = QuaternionIR(self.names, self.current_pos)
+            yield from completed
+            node = self.next_node()
+
     def _generate(self):
         node = self.next_node()
         while node is not None:
-            last_chain = self.parse_node(node)
+            self.backpatch(self.parse_node(node), self.current_pos + 1)
             node = self.next_node()
-            if last_chain is not None:
-                self.backpatch(last_chain, self.current_pos + 1)
-
-    def parse_node(self, node: StatementNode):
-        if type(node) is ProgramNode:
-            # Do nothing since we only support single file with single program currently.
-            pass
-        elif type(node) is VariableAssignmentNode:
-            self.parse_variable_assignment(node)
-        elif type(node) is IfStatementNode:
-            return self.parse_if_statement(node)
-        elif type(node) is WhileStatementNode:
-            return self.parse_while_statement(node)
-        elif type(node) is RepeatStatementNode:
-            self.parse_repeat_statement(node)
-        else:
+
+    def parse_node(self, node: StatementNode) -> JumpList:
+        """
+        Translates a statement, and returns the jumps out of it that go to the next statement.
+        """
+        handler = self.statement_handlers.get(type(node))
+        if handler is None:
             raise QuaternizerException(f'Unexpected node type: {type(node)}', self.current_node)
+        return handler(node)
+
+    def parse_statements(self, statements: List[StatementNode]) -> JumpList:
+        chain = JumpList()
+        for statement in statements:
+            self.backpatch(chain, self.current_pos + 1)
+            chain = self.parse_node(statement)
+        return chain
+
+    def parse_program(self, node: ProgramNode):
+        # Do nothing since we only support single file with single program currently.
+        return JumpList()
 
     def parse_variable_assignment(self, node: VariableAssignmentNode):
         self._parse_variable_assignment(node)
+        return JumpList()
 
     def _parse_variable_assignment(self, node: VariableAssignmentNode):
         # TODO: we need to get variable type here
-        if type(node.value) is NumberLiteralNode:
-            self.emit(VariableAssignmentQuaternion(node.name.value, VariableType.Integer, str(node.value.value)))
-        elif type(node.value) is IdentifierNode:
-            self.emit(VariableAssignmentQuaternion(node.name.value, VariableType.Integer, node.value.value))
-        elif type(node.value) is BinaryExpressionNode:
-            result = self.calculate_expression(node.value)
-            self.emit(VariableAssignmentQuaternion(node.name.value, VariableType.Integer, result))
+        if type(node.value) is BinaryExpressionNode:
+            value = self.calculate_expression(node.value)
+        elif type(node.value) in self.leaf_operands:
+            value = self.leaf_operands[type(node.value)](node.value)
         else:
             raise QuaternizerException(f'Unexpected variable value node type: {type(node)}', self.current_node)
+        self.emit(Opcode.ASSIGN, value, NO_OPERAND, self.identifier_operand(node.name))
 
-    def calculate_expression(self, node: BinaryExpressionNode) -> str:
-        if type(node.left) is NumberLiteralNode:
-            lhs = str(node.left.value)
-        elif type(node.left) is IdentifierNode:
-            lhs = node.left.value
-        elif type(node.left) is BinaryExpressionNode:
-            lhs = self.calculate_expression(node.left)
-        else:
-            raise QuaternizerException(f'Unexpected expression operand: {type(node.left)}', self.current_node)
-        if type(node.right) is NumberLiteralNode:
-            rhs = str(node.right.value)
-        elif type(node.right) is IdentifierNode:
-            rhs = node.right.value
-        elif type(node.right) is BinaryExpressionNode:
-            rhs = self.calculate_expression(node.right)
-        else:
-            raise QuaternizerException(f'Unexpected expression operand: {type(node.right)}', self.current_node)
-        tmp = self.get_temporary_variable()
-        if node.operator is VT.PLUS:
-            op = '+'
-        elif node.operator is VT.MINUS:
-            op = '-'
-        elif node.operator is VT.MULT:
-            op = '*'
-        elif node.operator is VT.DIV:
-            op = '/'
-        else:
-            raise QuaternizerException(f'Unexpected expression operator: {node.operator.value}', self.current_node)
-        self.emit(CalculationQuaternion(lhs, rhs, op, tmp))
-        return tmp
+    def calculate_expression(self, node: BinaryExpressionNode) -> int:
+        """
+        Emits the calculation of an expression tree in post-order, with an explicit stack
+        rather than recursion, and returns the operand holding its result.
+        """
+        leaf_operands = self.leaf_operands
+        operands = list()
+        stack = [(node, False)]
+        while stack:
+            node, operands_done = stack.pop()
+            if type(node) is BinaryExpressionNode:
+                if not operands_done:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+                    continue
+                rhs = operands.pop()
+                lhs = operands.pop()
+                tmp = self.get_temporary_variable()
+                op = ARITHMETIC_OPERATORS.get(node.operator)
+                if op is None:
+                    raise QuaternizerException(f'Unexpected expression operator: {node.operator.value}',
+                                               self.current_node)
+                self.emit(op, lhs, rhs, tmp)
+                operands.append(tmp)
+            elif type(node) in leaf_operands:
+                operands.append(leaf_operands[type(node)](node))
+            else:
+                raise QuaternizerException(f'Unexpected expression operand: {type(node)}', self.current_node)
+        return operands[0]
 
     def parse_if_statement(self, node: IfStatementNode):
         return self._parse_if_statement(node)
 
     def _parse_if_statement(self, node: IfStatementNode):
         condition_begin, true_exit, false_exit = self.trans_condition(node.condition)
-        true_begin = self.current_pos + 1
-        self.backpatch(true_exit, true_begin)
-        # false exit should jump to the beginning of true statements
-        c_chain = false_exit
-        true_chain = 1
-        for statement in node.true_statements:
-            chain = self.parse_node(statement)
-            true_chain = chain if chain is not None else 1
-        # merge false exit and true statements exit, since they should jump to the same destination.
-        s_chain = self.merge(c_chain, true_chain)
-        jump_out = self.emit(UnconditionalJumpQuaternion(0))  # jump across false statements
+        # true exit jumps to the beginning of true statements
+        self.backpatch(true_exit, self.current_pos + 1)
+        true_chain = self.parse_statements(node.true_statements)
+        jump_out = self.emit_jump(Opcode.JUMP)  # jump across false statements
         # false exit jumps to false statements
-        self.backpatch(c_chain, jump_out + 1)
-        # true statements exit and jump out exit should jump to the same destination
-        tp_chain = self.merge(jump_out, true_chain)
-        false_chain = 1
-        for statement in node.false_statements:
-            chain = self.parse_node(statement)
-            false_chain = chain if chain is not None else 1
+        self.backpatch(false_exit, self.current_pos + 1)
+        false_chain = self.parse_statements(node.false_statements)
         # true statements, jump out and false statements should jump to the same destination
-        s_chain = self.merge(tp_chain, false_chain)
-        return s_chain
+        return merge(true_chain, jump_out, false_chain)
 
     def parse_while_statement(self, node: WhileStatementNode):
         condition_begin, true_exit, false_exit = self.trans_condition(node.condition)
-        while_begin = self.current_pos + 1
         # true exit jumps to the beginning of while statements
-        self.backpatch(true_exit, while_begin)
-        while_chain = 1
-        for statement in node.statements:
-            chain = self.parse_node(statement)
-            while_chain = chain if chain is not None else 1
+        self.backpatch(true_exit, self.current_pos + 1)
+        while_chain = self.parse_statements(node.statements)
         # jump to the beginning of the whole statement
         self.backpatch(while_chain, condition_begin)
-        self.emit(UnconditionalJumpQuaternion(condition_begin))
-        chain = false_exit
-        return chain
+        self.emit(Opcode.JUMP, result=label_operand(condition_begin))
+        return false_exit
 
     def parse_repeat_statement(self, node: RepeatStatementNode):
         repeat_begin = self.current_pos + 1
-        for statement in node.statements:
-            self.parse_node(statement)
+        repeat_chain = self.parse_statements(node.statements)
+        self.backpatch(repeat_chain, self.current_pos + 1)
         condition_begin, true_exit, false_exit = self.trans_condition(node.condition)
-        # trans_condition() will generate an unconditional jump for false exit,
-        # which is simply the next quaternion of repeat condition jump, so the false exit jump here is extra,
-        # we need to increase repeat_end to avoid false exit jump onto itself.
-        repeat_end = self.current_pos + 1
-        self.backpatch(true_exit, repeat_end)
+        # trans_condition() generates an unconditional jump for the false exit, right after
+        # the conditional jump of the true exit, which then leaves to the next statement.
         self.backpatch(false_exit, repeat_begin)
+        return true_exit
 
     def trans_condition(self, condition: BinaryExpressionNode):
         if condition.operator == VT.OR:
@@ -183,7 +210,7 @@ class Quaternizer:
             r_begin, r_true_exit, r_false_exit = self.trans_condition(condition.right)
             code_begin = l_begin
             self.backpatch(l_false_exit, r_begin)
-            true_exit = self.merge(l_true_exit, r_true_exit)
+            true_exit = merge(l_true_exit, r_true_exit)
             false_exit = r_false_exit
             return code_begin, true_exit, false_exit
         elif condition.operator == VT.AND:
@@ -192,77 +219,90 @@ class Quaternizer:
             code_begin = l_begin
             self.backpatch(l_true_exit, r_begin)
             true_exit = r_true_exit
-            false_exit = self.merge(l_false_exit, r_false_exit)
+            false_exit = merge(l_false_exit, r_false_exit)
             return code_begin, true_exit, false_exit
-        elif condition.operator == VT.EQ:
-            op = '='
-        elif condition.operator == VT.NE:
-            op = '!='
-        elif condition.operator == VT.GT:
-            op = '>'
-        elif condition.operator == VT.LT:
-            op = '<'
-        elif condition.operator == VT.GE:
-            op = '>='
-        elif condition.operator == VT.LE:
-            op = '<='
+        elif condition.operator in RELATIONAL_OPERATORS:
+            op = RELATIONAL_OPERATORS[condition.operator]
         else:
-            raise QuaternizerException(f'Unexpected condition operator: {condition.operator}')
-        if type(condition.left) is NumberLiteralNode:
-            lhs = str(condition.left.value)
-        elif type(condition.left) is IdentifierNode:
-            lhs = condition.left.value
+            raise QuaternizerException(f'Unexpected condition operator: {condition.operator}', self.current_node)
+        if type(condition.left) in self.leaf_operands:
+            lhs = self.leaf_operands[type(condition.left)](condition.left)
         elif type(condition.left) is BinaryExpressionNode:
             # TODO: We may need to backpatch and merge here too, but it seems that the control flow will not reach here.
             return self.trans_condition(condition.left)
         else:
             raise QuaternizerException(f'Unexpected condition operand: {condition.left}', self.current_node)
-        if type(condition.right) is NumberLiteralNode:
-            rhs = str(condition.right.value)
-        elif type(condition.right) is IdentifierNode:
-            rhs = condition.right.value
+        if type(condition.right) in self.leaf_operands:
+            rhs = self.leaf_operands[type(condition.right)](condition.right)
         elif type(condition.right) is BinaryExpressionNode:
             # TODO: We may need to backpatch and merge here too, but it seems that the control flow will not reach here.
             return self.trans_condition(condition.right)
         else:
             raise QuaternizerException(f'Unexpected condition operand: {condition.right}', self.current_node)
-        #true_exit = self.get_temporary_label()
-        #false_exit = self.get_temporary_label()
-        true_exit = 0
-        false_exit = 0
-        start_pos = self.emit(ConditionalJumpQuaternion(op, lhs, rhs, true_exit))
-        false_pos = self.emit(UnconditionalJumpQuaternion(false_exit))
-        return start_pos, start_pos, false_pos
-
-    def fill_label(self, label: str, pos: int):
-        for quaternion in self.quaternions:
-            if type(quaternion) is ConditionalJumpQuaternion:
-                if quaternion.dest == label:
-                    quaternion.dest = pos
-            elif type(quaternion) is UnconditionalJumpQuaternion:
-                if quaternion.dest == label:
-                    quaternion.dest = pos
-
-    def backpatch(self, head: int, dest: int):
-        head -= 1  # to index
-        while head != 0 and head < len(self.quaternions):
-            old_head = self.quaternions[head].dest
-            self.quaternions[head].dest = dest
-            head = old_head
-
-    def merge(self, lhs: int, rhs: int):
-        lhs -= 1  # to index
-        rhs -= 1  # to index
-        if rhs == 0:
-            return lhs + 1
-        else:
-            head = rhs
-            while head != 0 and head < len(self.quaternions):
-                old_head = head
-                head = self.quaternions[head].dest
-            # head == 0
-            self.quaternions[old_head].dest = lhs
-            return rhs + 1
+        start_pos = self.emit(op, lhs, rhs)
+        false_exit = self.emit_jump(Opcode.JUMP)
+        return start_pos, JumpList(start_pos), false_exit
 
+    def parse_if_fall_through(self, node: IfStatementNode):
+        false_exit = self.branch(node.condition, False)
+        true_chain = self.parse_statements(node.true_statements)
+        if not node.false_statements:
+            return merge(true_chain, false_exit)
+        jump_out = self.emit_jump(Opcode.JUMP)  # jump across false statements
+        self.backpatch(false_exit, self.current_pos + 1)
+        false_chain = self.parse_statements(node.false_statements)
+        return merge(true_chain, jump_out, false_chain)
+
+    def parse_while_fall_through(self, node: WhileStatementNode):
+        condition_begin = self.current_pos + 1
+        false_exit = self.branch(node.condition, False)
+        while_chain = self.parse_statements(node.statements)
+        self.backpatch(while_chain, condition_begin)
+        self.emit(Opcode.JUMP, result=label_operand(condition_begin))
+        return false_exit
 
+    def parse_repeat_fall_through(self, node: RepeatStatementNode):
+        repeat_begin = self.current_pos + 1
+        repeat_chain = self.parse_statements(node.statements)
+        self.backpatch(repeat_chain, self.current_pos + 1)
+        # loop again while the condition is false, and leave by falling through
+        self.backpatch(self.branch(node.condition, False), repeat_begin)
+        return JumpList()
+
+    def branch(self, condition: BinaryExpressionNode, sense: bool) -> JumpList:
+        """
+        Generates the jumps taken when condition is sense, falling through to the next quaternion
+        otherwise: one conditional jump per relational leaf, negated where needed.
+        """
+        if condition.operator == VT.OR or condition.operator == VT.AND:
+            # the sense for which the left operand decides the whole condition
+            shortcut = condition.operator == VT.OR
+            if sense == shortcut:
+                return merge(self.branch(condition.left, sense), self.branch(condition.right, sense))
+            decided = self.branch(condition.left, shortcut)
+            jumps = self.branch(condition.right, sense)
+            # the left operand deciding the condition is not sense, so it leaves by the fall through
+            self.backpatch(decided, self.current_pos + 1)
+            return jumps
+        elif condition.operator in RELATIONAL_OPERATORS:
+            op = RELATIONAL_OPERATORS[condition.operator]
+        else:
+            raise QuaternizerException(f'Unexpected condition operator: {condition.operator}', self.current_node)
+        operands = list()
+        for operand in (condition.left, condition.right):
+            if type(operand) in self.leaf_operands:
+                operands.append(self.leaf_operands[type(operand)](operand))
+            elif type(operand) is BinaryExpressionNode:
+                # same as trans_condition()
+                return self.branch(operand, sense)
+            else:
+                raise QuaternizerException(f'Unexpected condition operand: {operand}', self.current_node)
+        if not sense:
+            op = NEGATED[op]
+        return self.emit_jump(op, *operands)
 
+    def backpatch(self, jumps: JumpList, dest: int):
+        # jumps are always patched before the statement they belong to is flushed
+        patch = self.quaternions.patch
+        for pos in jumps:
+            patch(pos, dest)
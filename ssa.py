@@ -0,0 +1,405 @@
+from array import array
+from collections import deque
+from typing import Dict, List, Set
+from tpcc_types.quaternion import *
+from cfg import ControlFlowGraph, compact, jump_dest
+
+VARIABLE_KINDS = frozenset((OperandKind.VAR, OperandKind.TEMP))
+
+
+def dominance_frontiers(graph: ControlFlowGraph, idom: List[int]) -> List[Set[int]]:
+    """
+    The dominance frontier of every block, by the algorithm of Cooper, Harvey and Kennedy.
+    The entry is also entered from outside the program, so it is a join point as soon as
+    it has a predecessor.
+    """
+    frontiers = [set() for _ in graph.blocks]
+    for block in graph:
+        if idom[block.id] == -1:
+            continue
+        predecessors = [predecessor for predecessor in block.predecessors if idom[predecessor] != -1]
+        if block.id == 0:
+            stop = -1
+        elif len(predecessors) >= 2:
+            stop = idom[block.id]
+        else:
+            continue
+        for runner in predecessors:
+            while runner != stop:
+                frontiers[runner].add(block.id)
+                runner = -1 if runner == 0 else idom[runner]
+    return frontiers
+
+
+def dominator_tree(idom: List[int]) -> List[List[int]]:
+    """
+    The children of every block in the dominator tree, from the immediate dominators.
+    """
+    children = [list() for _ in idom]
+    for block_id, parent in enumerate(idom):
+        if parent != -1 and parent != block_id:
+            children[parent].append(block_id)
+    return children
+
+
+class Phi:
+    """
+    The merge of the values of a variable or temporary at the beginning of a block:
+    args holds one SSA value per incoming edge, in the order of ssa.incoming(block).
+    """
+    __slots__ = ('block', 'operand', 'value', 'args')
+
+    def __init__(self, block: int, operand: int, incoming: int):
+        self.block = block
+        self.operand = operand
+        self.value = -1
+        self.args = [-1] * incoming
+
+    def __repr__(self):
+        return f'Phi(block={self.block}, operand={self.operand}, value={self.value}, args={self.args})'
+
+
+class SSAForm:
+    """
+    Static single assignment form of an IR, semi-pruned, kept beside the quaternions:
+    every assignment defines a new SSA value, every read of a variable or temporary refers to
+    the value reaching it, and phis merge values where definitions meet on dominance frontiers.
+    Values are numbered from 0. Their definitions are quaternion indexes, ~phi ids for phis,
+    or ENTRY for the value a variable has when the program starts.
+    Unreachable blocks are left out: their operands refer to no value (-1).
+    """
+    ENTRY = -1 << 62
+
+    graph: ControlFlowGraph
+    idom: List[int]
+    frontiers: List[Set[int]]
+    phis: List[Phi]
+    block_phis: List[List[int]]  # phi ids of every block
+    value_operands: List[int]  # the variable or temporary of every value
+    value_defs: List[int]
+    uses: List[List[int]]  # the quaternion indexes and ~phi ids reading every value
+
+    def __init__(self, ir: QuaternionIR):
+        self.ir = ir
+        self.graph = graph = ControlFlowGraph(ir)
+        self.idom = graph.dominators()
+        self.frontiers = dominance_frontiers(graph, self.idom)
+        count = len(ir)
+        self.lhs_values = array('q', [-1]) * count
+        self.rhs_values = array('q', [-1]) * count
+        self.result_values = array('q', [-1]) * count
+        self.value_operands = list()
+        self.value_defs = list()
+        self.uses = list()
+        self.phis = list()
+        self.block_phis = [list() for _ in graph.blocks]
+        self.place_phis()
+        self.rename()
+
+    def incoming(self, block_id: int) -> List[int]:
+        """
+        The blocks entering block_id, -1 standing for the start of the program.
+        """
+        predecessors = self.graph.blocks[block_id].predecessors
+        return [-1] + predecessors if block_id == 0 else predecessors
+
+    def new_value(self, operand: int, definition: int) -> int:
+        self.value_operands.append(operand)
+        self.value_defs.append(definition)
+        self.uses.append(list())
+        return len(self.value_operands) - 1
+
+    def place_phis(self):
+        """
+        Places phis on the iterated dominance frontiers of the blocks assigning each operand, for the
+        operands read in a block before being assigned there (semi-pruned SSA): the others, like most
+        temporaries, never need merging.
+        """
+        ir, graph, idom = self.ir, self.graph, self.idom
+        opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+        defining: Dict[int, Set[int]] = dict()  # operand -> the blocks assigning it
+        crossing = set()  # operands live across blocks
+        for block in graph:
+            if idom[block.id] == -1:
+                continue
+            assigned = set()
+            for index in range(block.start, block.end):
+                operand = lhs[index]
+                if operand & OPERAND_MASK in VARIABLE_KINDS and operand not in assigned:
+                    crossing.add(operand)
+                operand = rhs[index]
+                if operand & OPERAND_MASK in VARIABLE_KINDS and operand not in assigned:
+                    crossing.add(operand)
+                if opcodes[index] in ASSIGNING_OPCODES:
+                    assigned.add(results[index])
+            for operand in assigned:
+                defining.setdefault(operand, set()).add(block.id)
+        # program variables are read after the end of the program
+        crossing.update(operand for operand in defining if operand & OPERAND_MASK == OperandKind.VAR)
+
+        for operand, blocks in defining.items():
+            if operand not in crossing:
+                continue
+            worklist = list(blocks)
+            placed = set()
+            while worklist:
+                for frontier in self.frontiers[worklist.pop()]:
+                    if frontier in placed or frontier == graph.exit.id:
+                        continue
+                    placed.add(frontier)
+                    self.block_phis[frontier].append(len(self.phis))
+                    self.phis.append(Phi(frontier, operand, len(self.incoming(frontier))))
+                    if frontier not in blocks:
+                        worklist.append(frontier)
+
+    def rename(self):
+        """
+        Numbers the values by a walk of the dominator tree, with a stack of the current value
+        of every operand.
+        """
+        ir, graph = self.ir, self.graph
+        opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+        lhs_values, rhs_values, result_values = self.lhs_values, self.rhs_values, self.result_values
+        value_operands, value_defs, uses = self.value_operands, self.value_defs, self.uses
+        children = dominator_tree(self.idom)
+        # every operand starts with the value it has when the program starts
+        stacks: Dict[int, List[int]] = dict()
+        for operand in set(lhs) | set(rhs) | set(results):
+            if operand & OPERAND_MASK in VARIABLE_KINDS:
+                stacks[operand] = [self.new_value(operand, self.ENTRY)]
+
+        def fill_phis(source: int, block_id: int):
+            slot = self.incoming(block_id).index(source)
+            for phi_id in self.block_phis[block_id]:
+                phi = self.phis[phi_id]
+                value = phi.args[slot] = stacks[phi.operand][-1]
+                uses[value].append(~phi_id)
+
+        fill_phis(-1, 0)
+        walk = [(0, None)]
+        while walk:
+            block_id, pushed = walk.pop()
+            if pushed is not None:
+                # leaving the block: its definitions go out of scope
+                for operand in pushed:
+                    stacks[operand].pop()
+                continue
+            block = graph.blocks[block_id]
+            pushed = list()
+            for phi_id in self.block_phis[block_id]:
+                phi = self.phis[phi_id]
+                phi.value = self.new_value(phi.operand, ~phi_id)
+                stacks[phi.operand].append(phi.value)
+                pushed.append(phi.operand)
+            for index in range(block.start, block.end):
+                operand = lhs[index]
+                if operand & OPERAND_MASK in VARIABLE_KINDS:
+                    value = lhs_values[index] = stacks[operand][-1]
+                    uses[value].append(index)
+                operand = rhs[index]
+                if operand & OPERAND_MASK in VARIABLE_KINDS:
+                    value = rhs_values[index] = stacks[operand][-1]
+                    uses[value].append(index)
+                if opcodes[index] in ASSIGNING_OPCODES:
+                    operand = results[index]
+                    value = result_values[index] = len(value_operands)
+                    value_operands.append(operand)
+                    value_defs.append(index)
+                    uses.append(list())
+                    stacks[operand].append(value)
+                    pushed.append(operand)
+            for successor in block.successors:
+                fill_phis(block_id, successor)
+            walk.append((block_id, pushed))
+            for child in reversed(children[block_id]):
+                walk.append((child, None))
+
+
+# the lattice of sparse conditional constant propagation, besides constant values
+UNDEFINED = None  # no definition reaching it was executed yet
+OVERDEFINED = object()  # not a constant
+
+
+class ConditionalConstants:
+    """
+    Sparse conditional constant propagation (Wegman and Zadeck) over an SSAForm: the constant
+    value of every SSA value, and which edges of the graph can be taken at all. Values are only
+    evaluated when their definitions may execute, so constants flowing through branches that are
+    never taken do not spoil the merges, and the work done is linear in the size of the SSA form.
+    """
+    ssa: SSAForm
+    values: List  # UNDEFINED, OVERDEFINED or the constant of every SSA value
+    executable: bytearray  # flags the blocks that can execute
+    edges: Set  # the (source, destination) edges that can be taken, -1 being the start
+
+    def __init__(self, ssa: SSAForm):
+        self.ssa = ssa
+        self.values = [OVERDEFINED if definition == SSAForm.ENTRY else UNDEFINED for definition in ssa.value_defs]
+        self.executable = bytearray(len(ssa.graph.blocks))
+        self.edges = set()
+        self.flow = deque([(-1, 0)])
+        self.pending = deque()  # sites reading a value that changed
+        self.run()
+
+    def run(self):
+        ssa = self.ssa
+        blocks = ssa.graph.blocks
+        block_of = ssa.graph.block_of
+        while self.flow or self.pending:
+            while self.flow:
+                edge = self.flow.popleft()
+                if edge in self.edges:
+                    continue
+                self.edges.add(edge)
+                block_id = edge[1]
+                for phi_id in ssa.block_phis[block_id]:
+                    self.visit_phi(phi_id)
+                if self.executable[block_id]:
+                    continue
+                self.executable[block_id] = 1
+                block = blocks[block_id]
+                for index in range(block.start, block.end):
+                    self.visit(index)
+                if block.start == block.end or ssa.ir.opcodes[block.end - 1] not in JUMP_OPCODES:
+                    for successor in block.successors:
+                        self.flow.append((block_id, successor))
+            while self.pending:
+                site = self.pending.popleft()
+                if site < 0:
+                    if self.executable[ssa.phis[~site].block]:
+                        self.visit_phi(~site)
+                elif self.executable[block_of[site]]:
+                    self.visit(site)
+
+    def lower(self, value: int, lattice):
+        known = self.values[value]
+        if known is OVERDEFINED or known == lattice:
+            return
+        if known is not UNDEFINED:
+            lattice = OVERDEFINED  # values only go down the lattice
+        self.values[value] = lattice
+        self.pending.extend(self.ssa.uses[value])
+
+    def operand_lattice(self, operand: int, value: int):
+        if operand & OPERAND_MASK == OperandKind.CONST:
+            return operand >> OPERAND_SHIFT
+        return self.values[value]
+
+    def visit_phi(self, phi_id: int):
+        phi = self.ssa.phis[phi_id]
+        lattice = UNDEFINED
+        for source, value in zip(self.ssa.incoming(phi.block), phi.args):
+            if (source, phi.block) not in self.edges:
+                continue
+            arg = self.values[value]
+            if arg is UNDEFINED:
+                continue
+            if arg is OVERDEFINED or (lattice is not UNDEFINED and lattice != arg):
+                lattice = OVERDEFINED
+                break
+            lattice = arg
+        self.lower(phi.value, lattice)
+
+    def visit(self, index: int):
+        ssa = self.ssa
+        ir = ssa.ir
+        opcode = ir.opcodes[index]
+        if opcode == Opcode.JUMP:
+            # no operands, so no SSA values to look up
+            block_id = ssa.graph.block_of[index]
+            self.flow.append((block_id, ssa.graph.block_of[self.clamped_dest(index)]))
+            return
+        a = self.operand_lattice(ir.lhs[index], ssa.lhs_values[index])
+        if opcode == Opcode.ASSIGN:
+            self.lower(ssa.result_values[index], a)
+            return
+        b = self.operand_lattice(ir.rhs[index], ssa.rhs_values[index])
+        if a is OVERDEFINED or b is OVERDEFINED:
+            lattice = OVERDEFINED
+        elif a is UNDEFINED or b is UNDEFINED:
+            lattice = UNDEFINED
+        elif opcode == Opcode.DIV and b == 0:
+            lattice = OVERDEFINED  # left to run time
+        elif opcode in EVALUATE:
+            lattice = EVALUATE[opcode](a, b)
+        else:
+            lattice = COMPARE[opcode](a, b)
+        if opcode in EVALUATE:
+            self.lower(ssa.result_values[index], lattice)
+            return
+        # conditional jumps take their edges once their outcome is known or may vary
+        block_id = ssa.graph.block_of[index]
+        if lattice is UNDEFINED:
+            return
+        if lattice is OVERDEFINED or lattice:
+            self.flow.append((block_id, ssa.graph.block_of[self.clamped_dest(index)]))
+        if lattice is OVERDEFINED or not lattice:
+            self.flow.append((block_id, block_id + 1))
+
+    def clamped_dest(self, index: int) -> int:
+        return min(max(jump_dest(self.ssa.ir, index), 0), len(self.ssa.ir))
+
+    def constant(self, value: int):
+        """
+        The constant of an SSA value, None if it is not one.
+        """
+        lattice = self.values[value] if value >= 0 else OVERDEFINED
+        return None if lattice is UNDEFINED or lattice is OVERDEFINED else lattice
+
+
+def out_of_ssa(constants: ConditionalConstants) -> QuaternionIR:
+    """
+    Translates back to plain quaternions by dropping the SSA values, once their constants are
+    substituted: the reads of constants become constant operands, calculations of constants become
+    assignments, conditional jumps decided one way become unconditional jumps or are removed, and so
+    are unreachable blocks and the temporaries no longer read. Nothing is moved, so the live ranges
+    of the versions of a variable never overlap, and phis can be dropped without copies.
+    """
+    ssa = constants.ssa
+    ir = ssa.ir
+    count = len(ir)
+    opcodes, lhs, rhs, results = ir.opcodes, ir.lhs, ir.rhs, ir.results
+    graph = ssa.graph
+    keep = bytearray(count)
+    for block in graph:
+        if not constants.executable[block.id]:
+            continue
+        for index in range(block.start, block.end):
+            keep[index] = 1
+            for column, values in ((lhs, ssa.lhs_values), (rhs, ssa.rhs_values)):
+                constant = constants.constant(values[index])
+                if constant is not None:
+                    column[index] = const_operand(constant)
+            opcode = opcodes[index]
+            if opcode in EVALUATE:
+                constant = constants.constant(ssa.result_values[index])
+                if constant is not None:
+                    opcodes[index] = Opcode.ASSIGN
+                    lhs[index] = const_operand(constant)
+                    rhs[index] = NO_OPERAND
+            elif opcode in COMPARE:
+                taken = (block.id, graph.block_of[constants.clamped_dest(index)]) in constants.edges
+                falls = (block.id, block.id + 1) in constants.edges
+                if not falls:
+                    opcodes[index] = Opcode.JUMP
+                    lhs[index] = rhs[index] = NO_OPERAND
+                elif not taken:
+                    keep[index] = 0
+
+    read = set()
+    for index in range(count):
+        if keep[index]:
+            read.add(lhs[index])
+            read.add(rhs[index])
+    for index in range(count):
+        if opcodes[index] == Opcode.ASSIGN and results[index] & OPERAND_MASK == OperandKind.TEMP \
+                and results[index] not in read:
+            keep[index] = 0
+    return compact(ir, keep)
+
+
+def propagate_constants(ir: QuaternionIR) -> QuaternionIR:
+    """
+    Whole-program constant propagation through SSA form, pruning the branches never taken.
+    """
+    return out_of_ssa(ConditionalConstants(SSAForm(ir)))
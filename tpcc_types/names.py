@@ -0,0 +1,45 @@
+from typing import List
+from tpcc_types.parser import IdentifierNode, NumberLiteralNode
+
+
+class NameTable:
+    """
+    Interns the identifiers and integer constants of a program: each distinct spelling gets a small
+    integer id, and equal IdentifierNode / NumberLiteralNode leaves are shared (hash-consed).
+    """
+    names: List[str]
+    ids: dict[str, int]
+    identifiers: dict[str, IdentifierNode]
+    numbers: dict[int, NumberLiteralNode]
+
+    def __init__(self):
+        self.names = list()
+        self.ids = dict()
+        self.identifiers = dict()
+        self.numbers = dict()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, name: str) -> int:
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.ids[name] = name_id
+        return name_id
+
+    def identifier(self, name: str) -> IdentifierNode:
+        node = self.identifiers.get(name)
+        if node is None:
+            name_id = self.intern(name)
+            node = IdentifierNode(self.names[name_id], name_id)
+            self.identifiers[name] = node
+        return node
+
+    def number(self, value: int) -> NumberLiteralNode:
+        node = self.numbers.get(value)
+        if node is None:
+            node = NumberLiteralNode(value, self.intern(str(value)))
+            self.numbers[value] = node
+        return node
@@ -7,20 +7,30 @@ class VariableType(Enum):
     Integer = 1
 
 
+def node_fields(node) -> dict:
+    return {name: getattr(node, name) for name in type(node).__slots__}
+
+
 class ExpressionBaseNode:
+    __slots__ = ()
+
     def __str__(self):
-        return f'{type(self).__name__}: {self.__dict__}'
+        return f'{type(self).__name__}: {node_fields(self)}'
 
 
 
 class NumberLiteralNode(ExpressionBaseNode):
+    __slots__ = ('value', 'name_id')
     value: int
+    name_id: int  # id of its spelling in a NameTable, -1 if not interned
 
-    def __init__(self, value: int):
+    def __init__(self, value: int, name_id: int = -1):
         self.value = value
+        self.name_id = name_id
 
 
 class BinaryExpressionNode(ExpressionBaseNode):
+    __slots__ = ('left', 'right', 'operator')
     left: ExpressionBaseNode
     right: ExpressionBaseNode
     operator: Operator
@@ -32,18 +42,24 @@ class BinaryExpressionNode(ExpressionBaseNode):
 
 
 class IdentifierNode(ExpressionBaseNode):
+    __slots__ = ('value', 'name_id')
     value: str
+    name_id: int  # id in a NameTable, -1 if not interned
 
-    def __init__(self, value: str):
+    def __init__(self, value: str, name_id: int = -1):
         self.value = value
+        self.name_id = name_id
 
 
 class StatementNode:
+    __slots__ = ()
+
     def __str__(self):
-        return f'{type(self).__name__}: {self.__dict__}'
+        return f'{type(self).__name__}: {node_fields(self)}'
 
 
 class PrintStatementNode(StatementNode):
+    __slots__ = ('expression',)
     expression: ExpressionBaseNode
 
     def __init__(self, expression: ExpressionBaseNode):
@@ -51,6 +67,7 @@ class PrintStatementNode(StatementNode):
 
 
 class ReadStatementNode(StatementNode):
+    __slots__ = ('name',)
     name: IdentifierNode
 
     def __init__(self, name: IdentifierNode):
@@ -58,6 +75,7 @@ class ReadStatementNode(StatementNode):
 
 
 class VariableAssignmentNode(StatementNode):
+    __slots__ = ('name', 'value')
     name: IdentifierNode
     value: ExpressionBaseNode
 
@@ -67,6 +85,7 @@ class VariableAssignmentNode(StatementNode):
 
 
 class VariableDeclarationNode(ExpressionBaseNode):
+    __slots__ = ('names', 'variable_type')
     names: List[IdentifierNode]
     variable_type: VariableType
 
@@ -76,6 +95,7 @@ class VariableDeclarationNode(ExpressionBaseNode):
 
 
 class IfStatementNode(StatementNode):
+    __slots__ = ('condition', 'true_statements', 'false_statements')
     condition: ExpressionBaseNode
     true_statements: List[StatementNode]
     false_statements: List[StatementNode]
@@ -88,6 +108,8 @@ class IfStatementNode(StatementNode):
 
 
 class WhileStatementNode(StatementNode):
+    __slots__ = ('condition', 'statements')
+
     def __init__(self, condition: ExpressionBaseNode, statements: List[StatementNode]):
         condition: ExpressionBaseNode
         statements: List[StatementNode]
@@ -97,6 +119,7 @@ class WhileStatementNode(StatementNode):
 
 
 class RepeatStatementNode(StatementNode):
+    __slots__ = ('condition', 'statements')
     condition: ExpressionBaseNode
     statements: List[StatementNode]
 
@@ -106,6 +129,7 @@ class RepeatStatementNode(StatementNode):
 
 
 class ProgramNode(StatementNode):
+    __slots__ = ('program_name',)
     program_name: str
 
     def __init__(self, program_name: str):
@@ -1,61 +1,298 @@
+from array import array
+from enum import IntEnum
+from typing import Iterator, Optional
 from tpcc_types.parser import VariableType
+from tpcc_types.names import NameTable
+
+
+class Opcode(IntEnum):
+    ASSIGN = 0
+    ADD = 1
+    SUB = 2
+    MUL = 3
+    DIV = 4
+    # conditional jumps, to the position in result
+    JEQ = 5
+    JNE = 6
+    JGT = 7
+    JLT = 8
+    JGE = 9
+    JLE = 10
+    JUMP = 11
+    SHL = 12  # only made by optimizations
+
+
+OPCODE_SYMBOLS = {
+    Opcode.ASSIGN: ':=',
+    Opcode.ADD: '+', Opcode.SUB: '-', Opcode.MUL: '*', Opcode.DIV: '/',
+    Opcode.JEQ: 'j=', Opcode.JNE: 'j!=', Opcode.JGT: 'j>', Opcode.JLT: 'j<', Opcode.JGE: 'j>=', Opcode.JLE: 'j<=',
+    Opcode.JUMP: 'j ',
+    Opcode.SHL: '<<',
+}
+
+ARITHMETIC_OPCODES = frozenset((Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.SHL))
+CONDITIONAL_JUMP_OPCODES = frozenset((Opcode.JEQ, Opcode.JNE, Opcode.JGT, Opcode.JLT, Opcode.JGE, Opcode.JLE))
+JUMP_OPCODES = CONDITIONAL_JUMP_OPCODES | {Opcode.JUMP}
+# the opcodes assigning their result operand
+ASSIGNING_OPCODES = ARITHMETIC_OPCODES | {Opcode.ASSIGN}
+
+
+# Integers are 32-bit, like the constants accepted by the lexer, and wrap around on overflow.
+INT_BITS = 32
+INT_MIN = -(1 << (INT_BITS - 1))
+INT_MAX = (1 << (INT_BITS - 1)) - 1
+
+
+def wrap_int(value: int) -> int:
+    return (value - INT_MIN) % (1 << INT_BITS) + INT_MIN
+
+
+def divide(lhs: int, rhs: int) -> int:
+    """
+    Integer division, truncated toward zero. Raises ZeroDivisionError.
+    """
+    quotient = abs(lhs) // abs(rhs)
+    return wrap_int(quotient if (lhs < 0) == (rhs < 0) else -quotient)
+
+
+# What arithmetic opcodes compute, and when conditional jumps are taken, on 32-bit integers.
+EVALUATE = {
+    Opcode.ADD: lambda lhs, rhs: wrap_int(lhs + rhs),
+    Opcode.SUB: lambda lhs, rhs: wrap_int(lhs - rhs),
+    Opcode.MUL: lambda lhs, rhs: wrap_int(lhs * rhs),
+    Opcode.DIV: divide,
+    Opcode.SHL: lambda lhs, rhs: wrap_int(lhs << rhs),
+}
+
+COMPARE = {
+    Opcode.JEQ: lambda lhs, rhs: lhs == rhs,
+    Opcode.JNE: lambda lhs, rhs: lhs != rhs,
+    Opcode.JGT: lambda lhs, rhs: lhs > rhs,
+    Opcode.JLT: lambda lhs, rhs: lhs < rhs,
+    Opcode.JGE: lambda lhs, rhs: lhs >= rhs,
+    Opcode.JLE: lambda lhs, rhs: lhs <= rhs,
+}
+
+# The conditional jump taken exactly when the other one is not.
+NEGATED = {
+    Opcode.JEQ: Opcode.JNE, Opcode.JNE: Opcode.JEQ,
+    Opcode.JGT: Opcode.JLE, Opcode.JLE: Opcode.JGT,
+    Opcode.JLT: Opcode.JGE, Opcode.JGE: Opcode.JLT,
+}
+
+
+class OperandKind(IntEnum):
+    """
+    Operands are tagged ints: the value shifted left by OPERAND_SHIFT, or'ed with the kind.
+    """
+    NONE = 0
+    VAR = 1  # a program variable, by its NameTable id
+    TEMP = 2  # a temporary variable, by its number
+    CONST = 3  # an integer constant, by its value
+    LABEL = 4  # a quaternion position
+
+
+OPERAND_SHIFT = 3
+OPERAND_MASK = (1 << OPERAND_SHIFT) - 1
+NO_OPERAND = 0
+
+
+def var_operand(name_id: int) -> int:
+    return name_id << OPERAND_SHIFT | OperandKind.VAR
+
+
+def temp_operand(number: int) -> int:
+    return number << OPERAND_SHIFT | OperandKind.TEMP
+
+
+def const_operand(value: int) -> int:
+    return value << OPERAND_SHIFT | OperandKind.CONST
+
+
+def label_operand(pos: int) -> int:
+    return pos << OPERAND_SHIFT | OperandKind.LABEL
+
+
+def operand_kind(operand: int) -> int:
+    return operand & OPERAND_MASK
+
+
+def operand_value(operand: int) -> int:
+    return operand >> OPERAND_SHIFT
+
+
+def is_variable(operand: int) -> bool:
+    """
+    Whether operand is a program variable or a temporary.
+    """
+    kind = operand & OPERAND_MASK
+    return kind == OperandKind.VAR or kind == OperandKind.TEMP
+
+
+class QuaternionIR:
+    """
+    Quaternions stored as parallel typed arrays of opcodes, operands A and B and results.
+    Positions are 1-based and start after base, the number of quaternions before this segment.
+    """
+    names: NameTable
+    base: int
+
+    def __init__(self, names: Optional[NameTable] = None, base: int = 0):
+        self.names = names if names is not None else NameTable()
+        self.base = base
+        self.opcodes = array('b')
+        self.lhs = array('q')
+        self.rhs = array('q')
+        self.results = array('q')
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index: int) -> 'Quaternion':
+        if not 0 <= index < len(self.opcodes):
+            raise IndexError('quaternion index out of range')
+        return VIEWS[self.opcodes[index]](self, index)
+
+    def __iter__(self) -> Iterator['Quaternion']:
+        opcodes = self.opcodes
+        for index in range(len(opcodes)):
+            yield VIEWS[opcodes[index]](self, index)
+
+    def append(self, opcode: Opcode, lhs: int = NO_OPERAND, rhs: int = NO_OPERAND, result: int = NO_OPERAND) -> int:
+        """
+        Appends a quaternion and returns its position.
+        """
+        self.opcodes.append(opcode)
+        self.lhs.append(lhs)
+        self.rhs.append(rhs)
+        self.results.append(result)
+        return self.base + len(self.opcodes)
+
+    def patch(self, pos: int, dest: int):
+        """
+        Sets the destination of the jump at pos.
+        """
+        index = pos - 1 - self.base
+        if not 0 <= index < len(self.opcodes):
+            raise IndexError(f'quaternion {pos} is not in this segment')
+        self.results[index] = label_operand(dest)
+
+    def format_operand(self, operand: int) -> str:
+        kind = operand & OPERAND_MASK
+        value = operand >> OPERAND_SHIFT
+        if kind == OperandKind.VAR:
+            return self.names.names[value]
+        elif kind == OperandKind.TEMP:
+            return f't{value}'
+        elif kind == OperandKind.CONST or kind == OperandKind.LABEL:
+            return str(value)
+        return '-'
+
+    def format(self, index: int) -> str:
+        opcode = self.opcodes[index]
+        lhs = self.format_operand(self.lhs[index])
+        rhs = self.format_operand(self.rhs[index])
+        result = self.format_operand(self.results[index])
+        if opcode in JUMP_OPCODES:
+            result = f'({result})'
+        return f'({OPCODE_SYMBOLS[opcode]}, {lhs}, {rhs}, {result})'
 
 
 class Quaternion:
-    pass
+    """
+    A view of the quaternion at index of a QuaternionIR.
+    """
+    __slots__ = ('ir', 'index')
 
+    def __init__(self, ir: QuaternionIR, index: int):
+        self.ir = ir
+        self.index = index
 
-class VariableAssignmentQuaternion(Quaternion):
-    variable_name: str
-    variable_type: VariableType
-    value: None
+    @property
+    def pos(self) -> int:
+        return self.ir.base + self.index + 1
 
-    def __init__(self, variable_name: str, variable_type: VariableType, value):
-        self.variable_name = variable_name
-        self.variable_type = variable_type
-        self.value = value
+    @property
+    def opcode(self) -> Opcode:
+        return Opcode(self.ir.opcodes[self.index])
 
     def __str__(self):
-        return f'(:=, {self.value}, -, {self.variable_name})'
+        return self.ir.format(self.index)
+
+
+class VariableAssignmentQuaternion(Quaternion):
+    __slots__ = ()
+
+    @property
+    def variable_name(self) -> str:
+        return self.ir.format_operand(self.ir.results[self.index])
+
+    @property
+    def variable_type(self) -> VariableType:
+        return VariableType.Integer
+
+    @property
+    def value(self) -> str:
+        return self.ir.format_operand(self.ir.lhs[self.index])
 
 
 class CalculationQuaternion(Quaternion):
-    lhs: str
-    rhs: str
-    operator: str
-    dest: str
+    __slots__ = ()
 
-    def __init__(self, lhs: str, rhs: str, operator: str, dest: str):
-        self.lhs = lhs
-        self.rhs = rhs
-        self.operator = operator
-        self.dest = dest
+    @property
+    def lhs(self) -> str:
+        return self.ir.format_operand(self.ir.lhs[self.index])
 
-    def __str__(self):
-        return f'({self.operator}, {self.lhs}, {self.rhs}, {self.dest})'
+    @property
+    def rhs(self) -> str:
+        return self.ir.format_operand(self.ir.rhs[self.index])
 
+    @property
+    def operator(self) -> str:
+        return OPCODE_SYMBOLS[self.ir.opcodes[self.index]]
 
-class ConditionalJumpQuaternion(Quaternion):
-    operator: str
-    lhs: str
-    rhs: str
-    dest: int | str
+    @property
+    def dest(self) -> str:
+        return self.ir.format_operand(self.ir.results[self.index])
 
-    def __init__(self, operator: str, lhs: str, rhs: str, dest: int | str):
-        self.operator = operator
-        self.lhs = lhs
-        self.rhs = rhs
-        self.dest = dest
 
-    def __str__(self):
-        return f'(j{self.operator}, {self.lhs}, {self.rhs}, ({self.dest}))'
+class JumpQuaternion(Quaternion):
+    __slots__ = ()
 
+    @property
+    def dest(self) -> Optional[int]:
+        result = self.ir.results[self.index]
+        return operand_value(result) if operand_kind(result) == OperandKind.LABEL else None
 
-class UnconditionalJumpQuaternion(Quaternion):
-    dest: int | str
+    @dest.setter
+    def dest(self, pos: int):
+        self.ir.patch(self.pos, pos)
 
-    def __init__(self, dest: int | str):
-        self.dest = dest
 
-    def __str__(self):
-        return f'(j , -, -, ({self.dest}))'
+class ConditionalJumpQuaternion(JumpQuaternion):
+    __slots__ = ()
+
+    @property
+    def operator(self) -> str:
+        return OPCODE_SYMBOLS[self.ir.opcodes[self.index]][1:]
+
+    @property
+    def lhs(self) -> str:
+        return self.ir.format_operand(self.ir.lhs[self.index])
+
+    @property
+    def rhs(self) -> str:
+        return self.ir.format_operand(self.ir.rhs[self.index])
+
+
+class UnconditionalJumpQuaternion(JumpQuaternion):
+    __slots__ = ()
+
+
+VIEWS = [None] * len(Opcode)
+VIEWS[Opcode.ASSIGN] = VariableAssignmentQuaternion
+for _opcode in ARITHMETIC_OPCODES:
+    VIEWS[_opcode] = CalculationQuaternion
+for _opcode in CONDITIONAL_JUMP_OPCODES:
+    VIEWS[_opcode] = ConditionalJumpQuaternion
+VIEWS[Opcode.JUMP] = UnconditionalJumpQuaternion
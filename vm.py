@@ -0,0 +1,171 @@
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from tpcc_types.quaternion import *
+
+
+class VMException(Exception):
+    pass
+
+
+class Program:
+    """
+    Quaternions decoded for execution: every operand is resolved to a slot of the register file,
+    constants included, and jump destinations to instruction indexes, len(code) ending the program.
+    Instructions are (opcode, lhs slot, rhs slot, result slot or destination) tuples.
+    The declared variables come first among the program variables, and have a slot even when the
+    quaternions do not use them anymore.
+    """
+    code: List[Tuple[int, int, int, int]]
+    slot_names: List[str]  # the name of every slot, '' for constants
+    variable_slots: Dict[str, int]  # the slots of the program variables, by name
+    registers: List[int]  # the initial register file: constants, and zero for variables
+
+    def __init__(self, ir: QuaternionIR, declared: Sequence[str] = ()):
+        self.ir = ir
+        self.slots: Dict[int, int] = dict()  # operand -> slot
+        self.slot_names = list()
+        self.variable_slots = dict()
+        self.registers = list()
+        self.code = list()
+        count = len(ir)
+        for index in range(count):
+            opcode = ir.opcodes[index]
+            lhs = self.slot(ir.lhs[index])
+            rhs = self.slot(ir.rhs[index])
+            if opcode in JUMP_OPCODES:
+                dest = ir.results[index]
+                if operand_kind(dest) != OperandKind.LABEL:
+                    raise VMException(f'Jump without destination: ({ir.base + index + 1}) {ir.format(index)}')
+                result = operand_value(dest) - 1 - ir.base
+                if not 0 <= result <= count:
+                    raise VMException(f'Jump out of the program: ({ir.base + index + 1}) {ir.format(index)}')
+            else:
+                result = self.slot(ir.results[index])
+            self.code.append((opcode, lhs, rhs, result))
+        used = self.variable_slots
+        self.variable_slots = dict()
+        for name in declared:
+            if name not in used:
+                used[name] = len(self.registers)
+                self.slot_names.append(name)
+                self.registers.append(0)
+            self.variable_slots[name] = used[name]
+        self.variable_slots.update(used)
+
+    def slot(self, operand: int) -> int:
+        if operand == NO_OPERAND:
+            return -1
+        slot = self.slots.get(operand)
+        if slot is None:
+            slot = self.slots[operand] = len(self.registers)
+            if operand_kind(operand) == OperandKind.CONST:
+                self.slot_names.append('')
+                self.registers.append(operand_value(operand))
+            else:
+                self.slot_names.append(self.ir.format_operand(operand))
+                self.registers.append(0)
+                if operand_kind(operand) == OperandKind.VAR:
+                    self.variable_slots[self.slot_names[slot]] = slot
+        return slot
+
+    def variables(self, registers: List[int]) -> Dict[str, int]:
+        """
+        The values of the program variables in a register file.
+        """
+        return {name: registers[slot] for name, slot in self.variable_slots.items()}
+
+
+class VirtualMachine:
+    """
+    Runs a Program from its first instruction until it jumps or falls past its end. Variables start at
+    zero unless given, and arithmetic wraps around on 32 bits like the optimizer assumes.
+    Executes at most limit instructions if given.
+    """
+    program: Program
+    registers: List[int]
+    steps: int
+    seconds: float
+
+    def __init__(self, program: Program, limit: Optional[int] = None):
+        self.program = program
+        self.limit = limit
+        self.registers = program.registers
+        self.steps = 0
+        self.seconds = 0.0
+
+    def run(self, variables: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        program = self.program
+        registers = self.registers = list(program.registers)
+        for name, value in (variables or dict()).items():
+            if name in program.variable_slots:
+                registers[program.variable_slots[name]] = wrap_int(value)
+
+        start = time.perf_counter()
+        try:
+            self.steps = self.dispatch(registers)
+        finally:
+            self.seconds = time.perf_counter() - start
+        return program.variables(registers)
+
+    def dispatch(self, registers: List[int]) -> int:
+        code = self.program.code
+        end = len(code)
+        limit = self.limit if self.limit is not None else -1
+        # opcodes as plain ints, compared in the order of how often they execute
+        ASSIGN, ADD, SUB, MUL, DIV, SHL, JUMP = (int(opcode) for opcode in (
+            Opcode.ASSIGN, Opcode.ADD, Opcode.SUB, Opcode.MUL, Opcode.DIV, Opcode.SHL, Opcode.JUMP))
+        JEQ, JNE, JGT, JLT, JGE, JLE = (int(opcode) for opcode in (
+            Opcode.JEQ, Opcode.JNE, Opcode.JGT, Opcode.JLT, Opcode.JGE, Opcode.JLE))
+        low, high = INT_MIN, INT_MAX
+        pc = 0
+        steps = 0
+        while pc < end:
+            if steps == limit:
+                raise VMException(f'Stopped after {steps} instructions')
+            steps += 1
+            opcode, a, b, c = code[pc]
+            pc += 1
+            if opcode == ASSIGN:
+                registers[c] = registers[a]
+            elif opcode == ADD:
+                value = registers[a] + registers[b]
+                registers[c] = value if low <= value <= high else wrap_int(value)
+            elif opcode == JUMP:
+                pc = c
+            elif opcode == JLT:
+                if registers[a] < registers[b]:
+                    pc = c
+            elif opcode == JGE:
+                if registers[a] >= registers[b]:
+                    pc = c
+            elif opcode == SUB:
+                value = registers[a] - registers[b]
+                registers[c] = value if low <= value <= high else wrap_int(value)
+            elif opcode == MUL:
+                value = registers[a] * registers[b]
+                registers[c] = value if low <= value <= high else wrap_int(value)
+            elif opcode == JGT:
+                if registers[a] > registers[b]:
+                    pc = c
+            elif opcode == JLE:
+                if registers[a] <= registers[b]:
+                    pc = c
+            elif opcode == JEQ:
+                if registers[a] == registers[b]:
+                    pc = c
+            elif opcode == JNE:
+                if registers[a] != registers[b]:
+                    pc = c
+            elif opcode == DIV:
+                if registers[b] == 0:
+                    raise VMException(f'Division by zero at quaternion {self.program.ir.base + pc}')
+                registers[c] = divide(registers[a], registers[b])
+            elif opcode == SHL:
+                registers[c] = wrap_int(registers[a] << registers[b])
+            else:
+                raise VMException(f'Unknown opcode {opcode} at quaternion {self.program.ir.base + pc}')
+        return steps
+
+    def report(self) -> str:
+        rate = self.steps / self.seconds if self.seconds > 0 else 0.0
+        return f'{self.steps} quaternions executed in {self.seconds * 1000:.3f} ms, {rate:,.0f} per second'